@@ -7,6 +7,8 @@
 # before anything from that module is touched
 import gui.plotting
 
+from multiprocessing import freeze_support
+
 from gui.main import setup
 
 
@@ -17,4 +19,7 @@ def main():
 
 
 if __name__ == '__main__':
+    # saves are parsed in worker processes, which needs this when frozen
+    freeze_support()
+
     main()
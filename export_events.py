@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+
+# Copyright Sean Purdon 2014
+# All Rights Reserved
+
+# Exports the province ownership and controller changes from a save as flat
+# records, without starting the GUI.  With --occupations, exports every
+# occupation (when a province's controller wasn't its owner) instead.
+#
+# Like the viewer, this must be run from the directory containing
+# settings.cfg.
+
+from argparse import ArgumentParser
+import sys
+
+import model.settings as settings
+from model.export import write_events, write_occupations, FORMATS, \
+        FORMAT_CSV
+from model.occupations import OccupationIndex
+from model.ownership import OwnershipIndex
+from model.timeline import get_timeline_for_save
+from parsers.countries import parse_countries
+from parsers.provinces import parse_province_definitions, \
+        parse_province_original_owners
+
+
+def main():
+    parser = ArgumentParser(
+            description='Export province ownership changes from a save.')
+    parser.add_argument('save', help='the .eu4 save file')
+    parser.add_argument('output', help='the output file, or - for stdout')
+    parser.add_argument('--format', choices=FORMATS, default=FORMAT_CSV)
+    parser.add_argument('--include-start', action='store_true',
+            help='include the state of every province at the start date')
+    parser.add_argument('--occupations', action='store_true',
+            help='export occupations (occupier, owner, start and end) '
+                'instead of changes')
+
+    args = parser.parse_args()
+
+    # we don't need the map image or masks, just who owned what at the start
+    provinces = parse_province_definitions()
+    parse_province_original_owners(provinces)
+
+    countries = parse_countries()
+
+    timeline = get_timeline_for_save(args.save, provinces, countries,
+            settings.start_date)
+
+    if args.occupations:
+        occupations = OccupationIndex(OwnershipIndex(timeline))
+        fWrite = lambda f: write_occupations(f, occupations, provinces,
+                format=args.format)
+    else:
+        fWrite = lambda f: write_events(f, timeline, provinces,
+                format=args.format, includeStart=args.include_start)
+
+    if args.output == '-':
+        fWrite(sys.stdout)
+    else:
+        with open(args.output, 'wb') as f:
+            fWrite(f)
+
+
+if __name__ == '__main__':
+    main()
@@ -9,14 +9,20 @@ from threading import Thread
 import wx
 
 from contrib.images2gif import writeGif
+from model.campaign import Campaign
 from model.display import EU4Map
+from model.labels import CountryLabelLayer, FONT_DIRECTORY
+from model.navigation import EventIndex
+from model.occupations import OccupationIndex
+from model.ownership import OwnershipIndex
+from model.territory import TerritorySeries, RESOLUTIONS, sample_dates, \
+        province_pixel_counts
 import model.provinces as provinces
 import model.settings as settings
+from model.timeline import Timeline, get_timeline_for_save, ordinal_to_date
 from model.setup import setup_countries, setup_map, setup_provinces
-from parsers.countries import create_dynamic_countries
-from parsers.provinces import parse_province_original_owners
-from parsers.history import build_history
-from parsers.files import parse_file
+from parsers.provinces import parse_province_original_owners, \
+        get_province_start_states
 
 from helpers import PeriodicThread
 from plotting import pnlImagePlot
@@ -31,9 +37,20 @@ class frmEU4Viewer(wx.Frame):
     MENU_FILE_SAVES = 120
     MENU_FILE_SAVES_LOAD = 121
     MENU_FILE_SAVES_QUICKLOAD = 122
+    MENU_FILE_SAVES_CAMPAIGN = 123
+
+    MENU_NAVIGATE_NEXT = 310
+    MENU_NAVIGATE_PREVIOUS = 320
+    MENU_NAVIGATE_NEXT_TAG = 330
+    MENU_NAVIGATE_PREVIOUS_TAG = 340
+
+    MENU_VIEW_BORDERS = 410
+    MENU_VIEW_LABELS = 420
 
     MENU_TOOLS_SCREENSHOT = 210
     MENU_TOOLS_GIF = 220
+    MENU_TOOLS_TERRITORY = 230
+    MENU_TOOLS_HEATMAP = 240
 
     def __init__(self, parent, **kwargs):
         wx.Frame.__init__(self, None, title='EU4 Replay Viewer', **kwargs)
@@ -52,6 +69,10 @@ class frmEU4Viewer(wx.Frame):
         self.pnlMap = pnlImagePlot(self.pnl)
         self.vbx.Add(self.pnlMap, proportion=1, flag=wx.EXPAND)
 
+        # hovering over a province describes it
+        self.pnlMap.setMotionCallback(self.evt_motion)
+        self.hoverPID = None
+
         # Bottom stuff
         vbxBottom = wx.BoxSizer(wx.VERTICAL)
         self.vbx.Add(vbxBottom, proportion=0, flag=wx.EXPAND)
@@ -186,6 +207,46 @@ class frmEU4Viewer(wx.Frame):
         menuFileSaves.Append(self.MENU_FILE_SAVES_LOAD, '&Load Save File')
         self.Bind(wx.EVT_MENU, self.loadSave, id=self.MENU_FILE_SAVES_LOAD)
 
+        menuFileSaves.Append(self.MENU_FILE_SAVES_CAMPAIGN,
+                '&Add Saves to Campaign')
+        self.Bind(wx.EVT_MENU, self.loadCampaignSaves,
+                id=self.MENU_FILE_SAVES_CAMPAIGN)
+
+        ## Navigate menu
+        menuNavigate = wx.Menu()
+        menubar.Append(menuNavigate, '&Navigate')
+
+        menuNavigate.Append(self.MENU_NAVIGATE_NEXT, '&Next Event\tCtrl+N')
+        self.Bind(wx.EVT_MENU, self.navigateNextEvent,
+                id=self.MENU_NAVIGATE_NEXT)
+
+        menuNavigate.Append(self.MENU_NAVIGATE_PREVIOUS,
+                '&Previous Event\tCtrl+P')
+        self.Bind(wx.EVT_MENU, self.navigatePreviousEvent,
+                id=self.MENU_NAVIGATE_PREVIOUS)
+
+        menuNavigate.Append(self.MENU_NAVIGATE_NEXT_TAG,
+                'Next Event for &Tag...\tCtrl+Shift+N')
+        self.Bind(wx.EVT_MENU, self.navigateNextTagEvent,
+                id=self.MENU_NAVIGATE_NEXT_TAG)
+
+        menuNavigate.Append(self.MENU_NAVIGATE_PREVIOUS_TAG,
+                'Previous Event for T&ag...\tCtrl+Shift+P')
+        self.Bind(wx.EVT_MENU, self.navigatePreviousTagEvent,
+                id=self.MENU_NAVIGATE_PREVIOUS_TAG)
+
+        ## View menu
+        menuView = wx.Menu()
+        menubar.Append(menuView, '&View')
+
+        menuView.AppendCheckItem(self.MENU_VIEW_BORDERS,
+                'Country &Borders\tCtrl+B')
+        self.Bind(wx.EVT_MENU, self.toggleBorders, id=self.MENU_VIEW_BORDERS)
+
+        menuView.AppendCheckItem(self.MENU_VIEW_LABELS,
+                'Country &Names in Exports')
+        self.Bind(wx.EVT_MENU, self.toggleLabels, id=self.MENU_VIEW_LABELS)
+
         ## Tools menu
         menuTools = wx.Menu()
         menubar.Append(menuTools, '&Tools')
@@ -197,10 +258,28 @@ class frmEU4Viewer(wx.Frame):
         menuTools.Append(self.MENU_TOOLS_GIF, '&Create Animated GIF')
         self.Bind(wx.EVT_MENU, self.createAnimatedGIF, id=self.MENU_TOOLS_GIF)
 
+        menuTools.Append(self.MENU_TOOLS_TERRITORY,
+                'Export &Territory Series')
+        self.Bind(wx.EVT_MENU, self.exportTerritorySeries,
+                id=self.MENU_TOOLS_TERRITORY)
+
+        menuTools.Append(self.MENU_TOOLS_HEATMAP, 'Export Churn &Heatmap')
+        self.Bind(wx.EVT_MENU, self.exportChurnHeatmap,
+                id=self.MENU_TOOLS_HEATMAP)
+
         #### Instance Variables
         ## Properties which require user intervention
         self.provinces = None
         self.save = None
+        self.campaign = None
+        self.timeline = None
+        self.ownership = None
+        self.events = None
+        self.occupations = None
+        self.navigationTag = ''
+        self.showBorders = False
+        self.showLabels = False
+        self.labelLayer = None
         self._map = None
 
         #### Further Initialisation
@@ -235,9 +314,20 @@ class frmEU4Viewer(wx.Frame):
         wx.CallAfter(self.dlgProgress.UpdatePulse, 'Building country data...')
         self.countries = setup_countries()
 
+        # this comes from the cache, unless the map has never been seen
+        # before (or has changed)
+        wx.CallAfter(self.dlgProgress.UpdatePulse, 'Loading province data...')
+        self.provinces = setup_provinces()
+
+        wx.CallAfter(self.dlgProgress.UpdatePulse,
+                'Finding original province owners...')
+        parse_province_original_owners(self.provinces)
+
         periodicThread.stop()
         wx.CallAfter(self.dlgProgress.Destroy)
 
+        wx.CallAfter(self._createMap)
+
     ## Menu Event Callbacks
     def _promptForPath(self, message, wildcard, style):
         # show the file dialog, and have the user select a path
@@ -256,6 +346,19 @@ class frmEU4Viewer(wx.Frame):
         path = paths[0]
         return path
 
+    def _promptForPaths(self, message, wildcard, style):
+        dlg = wx.FileDialog(self, message=message, wildcard=wildcard,
+                style=style|wx.FD_MULTIPLE)
+
+        if dlg.ShowModal() != wx.ID_OK:
+            dlg.Destroy()
+            return
+
+        dlg.Destroy()
+
+        paths = dlg.GetPaths()
+        return list(paths) if paths else None
+
     def loadProvincesFile(self, evt):
         path = self._promptForPath(
                 message='Select the provinces file',
@@ -327,9 +430,8 @@ class frmEU4Viewer(wx.Frame):
             )
         periodicThread.start()
 
-        # generate the provinces data
-        # this will take a long time
-        self.provinces = setup_provinces()
+        # generate the provinces data from scratch
+        self.provinces = setup_provinces(useCache=False)
 
         # save the file to disk
         wx.CallAfter(self.dlgProgress.UpdatePulse, 'Writing file...')
@@ -375,30 +477,68 @@ class frmEU4Viewer(wx.Frame):
             )
         periodicThread.start()
 
-        # load the save
-        with open(path, 'rU') as f:
-            self.save = parse_file(f, header=True)
+        # parse the save for province histories and dynamic countries (in a
+        # single pass), or reuse the timeline stored from a previous load
+        assert self.provinces is not None # should test for this earlier
+        assert self.countries is not None
 
-        # parse the save for province histories
-        wx.CallAfter(self.dlgProgress.UpdatePulse,
-                'Determining province histories...')
+        timeline = get_timeline_for_save(path, self.provinces, self.countries,
+                settings.start_date)
 
-        assert self.provinces is not None # should test for this earlier
-        provinceHistories, countryHistories, datesWithEvents \
-                = build_history(self.save, self.provinces)
+        self.save = path
+        self.campaign = None
 
-        # create dynamic countries
-        wx.CallAfter(self.dlgProgress.UpdatePulse,
-                'Creating dynamic countries...')
+        periodicThread.stop()
+        wx.CallAfter(self.dlgProgress.Destroy)
+
+        wx.CallAfter(self._updateMapWithSave, timeline)
+
+    def loadCampaignSaves(self, evt):
+        paths = self._promptForPaths(
+                message='Select the save files from one campaign',
+                wildcard='EU4 Save files (*.eu4)|*.eu4',
+                style=wx.FD_OPEN
+            )
+
+        if paths is None:
+            return
 
+        # prepare the progress dialog
+        self.dlgProgress = wx.ProgressDialog(
+                title='Loading campaign',
+                message='Parsing save data...',
+                style=wx.PD_APP_MODAL
+            )
+
+        # run asynchronously
+        thread = Thread(target=self._loadCampaignSaves, args=(paths,))
+        thread.start()
+
+    def _loadCampaignSaves(self, paths):
+        periodicThread = PeriodicThread(
+                target=lambda : wx.CallAfter(self.dlgProgress.Pulse),
+                period=0.1,
+            )
+        periodicThread.start()
+
+        assert self.provinces is not None # should test for this earlier
         assert self.countries is not None
-        create_dynamic_countries(self.save, self.countries)
+
+        # saves already in the campaign are not parsed again
+        if self.campaign is None:
+            self.campaign = Campaign(self.provinces, self.countries)
+
+        self.campaign.addSaves(paths)
+        self.save = paths[-1]
+
+        timeline = Timeline.fromHistories(*self.campaign.histories(),
+                startStates=get_province_start_states(self.provinces),
+                startDate=settings.start_date, countries=self.countries)
 
         periodicThread.stop()
         wx.CallAfter(self.dlgProgress.Destroy)
 
-        wx.CallAfter(self._updateMapWithSave, provinceHistories,
-                countryHistories, datesWithEvents)
+        wx.CallAfter(self._updateMapWithSave, timeline)
 
     def exportScreenshot(self, evt):
         path = self._promptForPath(
@@ -411,10 +551,33 @@ class frmEU4Viewer(wx.Frame):
             return
 
         # this is quick enough to not bother with an async thread
+        self._saveImage(path, self._exportImage(), self.map.date)
+
+    def exportChurnHeatmap(self, evt):
+        if self.ownership is None:
+            return
+
+        path = self._promptForPath(
+                message='Choose where to save the image',
+                wildcard='PNG files (*.png)|*.png',
+                style=wx.FD_SAVE
+            )
+
+        if path is None:
+            return
+
+        # as with screenshots, this is quick enough to do in place
+        counts = self.ownership.ownershipChangeCounts()
+        img = self.map.renderHeatmap(counts)
+
+        lastDate = ordinal_to_date(self.timeline.dates.max())
+        self._saveImage(path, img, lastDate)
+
+    def _saveImage(self, path, img, date):
         if not path.endswith('.png'):
             path += '.png' # better hope they didn't put '.jpg'...
 
-        im = self._annotateImage((self.map.img, self.map.date))
+        im = self._annotateImage((img, date))
         im.save(path)
 
     def createAnimatedGIF(self, evt):
@@ -445,26 +608,23 @@ class frmEU4Viewer(wx.Frame):
             )
         periodicThread.start()
 
-        # generate the images
-        imageData = []
-        
-        self.map.renderAtDate(settings.start_date)
+        # a frame every tick_years years
+        start = settings.start_date
+        dates = []
 
-           # wayyyyy too much reaching into the map class.  fix!!
-        while self.map.date < settings.end_date:
-            imageData.append((self.map.img.copy(), self.map.date))
+        for years in xrange(0, settings.end_date.year - start.year + 1,
+                settings.gif_settings.tick_years):
+            date = datetime(start.year + years, start.month, start.day)
 
-            for _ in xrange(settings.gif_settings.tick_years):
-                self.map.tick(EU4Map.DELTA_YEAR)
+            if date < settings.end_date:
+                dates.append(date)
 
-        # convert the images
-        wx.CallAfter(self.dlgProgress.UpdatePulse, 'Converting images...')
-        
-        images = []
-        
-        for i,(img,date) in enumerate(imageData):
-            images.append(self._annotateImage((img, date)))
-            imageData[i] = None # clean up ASAP to prevent memory overflow
+        # generate the images; the map replays the history on its own copy,
+        # so what's on screen isn't touched, and each frame goes straight
+        # into the gif's image
+        overlay = self.labelLayer.draw if self.showLabels else None
+        images = [self._annotateImage((img, date)) for img,date,_
+                in self.map.frames(dates, overlay=overlay)]
 
         # build the gif file
         wx.CallAfter(self.dlgProgress.UpdatePulse, 'Creating GIF file...')
@@ -473,6 +633,68 @@ class frmEU4Viewer(wx.Frame):
         periodicThread.stop()
         wx.CallAfter(self.dlgProgress.Destroy)
 
+    def exportTerritorySeries(self, evt):
+        if self.ownership is None:
+            return
+
+        path = self._promptForPath(
+                message='Choose where to save the territory series',
+                wildcard='CSV files (*.csv)|*.csv|NumPy files (*.npz)|*.npz',
+                style=wx.FD_SAVE
+            )
+
+        if path is None:
+            return
+
+        dlg = wx.SingleChoiceDialog(self, 'Choose the date resolution',
+                'Territory Series', list(RESOLUTIONS))
+
+        if dlg.ShowModal() != wx.ID_OK:
+            dlg.Destroy()
+            return
+
+        resolution = dlg.GetStringSelection()
+        dlg.Destroy()
+
+        # prepare the progress dialog
+        self.dlgProgress = wx.ProgressDialog(
+                title='Exporting territory series',
+                message='Counting provinces...',
+                style=wx.PD_APP_MODAL
+            )
+
+        # run asynchronously
+        thread = Thread(target=self._exportTerritorySeries,
+                args=(path, resolution))
+        thread.start()
+
+    def _exportTerritorySeries(self, path, resolution):
+        periodicThread = PeriodicThread(
+                target=lambda : wx.CallAfter(self.dlgProgress.Pulse),
+                period=0.1,
+            )
+        periodicThread.start()
+
+        dates = sample_dates(settings.start_date, settings.end_date,
+                resolution)
+        pixelCounts = province_pixel_counts(self.timeline, self.provinces)
+
+        series = TerritorySeries.fromOwnership(self.ownership, dates,
+                pixelCounts)
+
+        wx.CallAfter(self.dlgProgress.UpdatePulse, 'Writing file...')
+
+        # csv can only hold one table, so areas go in a second file
+        if path.endswith('.npz'):
+            series.writeNumpy(path)
+        else:
+            root,_ = os.path.splitext(path)
+            series.writeCSV(root + '.csv')
+            series.writeCSV(root + '_area.csv', areas=True)
+
+        periodicThread.stop()
+        wx.CallAfter(self.dlgProgress.Destroy)
+
     # this does not belong here; we need a refactor
     def _annotateImage(self, (img, date)):
         if isinstance(img, Image.Image):
@@ -481,8 +703,10 @@ class frmEU4Viewer(wx.Frame):
             im = Image.fromarray(img)
 
         # TODO: move all the magic numbers from here (as part of refactor)
-        msgFont = ImageFont.truetype('resources/fonts/Ubuntu-L.ttf', 75)
-        dateFont = ImageFont.truetype('resources/fonts/Ubuntu-R.ttf', 75)
+        msgFont = ImageFont.truetype(
+                os.path.join(FONT_DIRECTORY, 'Ubuntu-L.ttf'), 75)
+        dateFont = ImageFont.truetype(
+                os.path.join(FONT_DIRECTORY, 'Ubuntu-R.ttf'), 75)
 
         draw = ImageDraw.Draw(im)
 
@@ -523,16 +747,42 @@ class frmEU4Viewer(wx.Frame):
         assert self.img is not None
         assert self.mapObject is not None
 
-        self.map = EU4Map(self.img, self.provinces, self.countries,
+        eu4Map = EU4Map(self.img, self.provinces, self.countries,
+                self.mapObject)
+        eu4Map.setShowBorders(self.showBorders)
+
+        # country names need the label map's geometry and adjacency
+        self.labelLayer = CountryLabelLayer(eu4Map.labelMap, self.countries,
                 self.mapObject)
+
+        self.map = eu4Map
+
+        # the new map has no history loaded, so neither should anything else
+        self.save = None
+        self.campaign = None
+        self.timeline = None
+        self.ownership = None
+        self.events = None
+        self.occupations = None
+
+        self.sliderDay.Enable(False)
+        self.sliderMonth.Enable(False)
+        self.sliderYear.Enable(False)
+
+        self.updateDateLabel(settings.start_date)
         self.updateStatus()
 
-    def _updateMapWithSave(self, provinceHistories, countryHistories,
-            datesWithEvents):
+    def _updateMapWithSave(self, timeline):
         assert self.save is not None
         assert self.map is not None
 
-        self.map.loadSave(provinceHistories, countryHistories, datesWithEvents)
+        # read-only queries over the history, independent of the map
+        self.timeline = timeline
+        self.ownership = OwnershipIndex(timeline)
+        self.events = EventIndex(self.ownership)
+        self.occupations = OccupationIndex(self.ownership)
+
+        self.map.loadTimeline(timeline, ownership=self.ownership)
         self.pnlMap.plot()
 
         self.sliderDay.Enable(True)
@@ -541,6 +791,77 @@ class frmEU4Viewer(wx.Frame):
 
         self.updateStatus()
 
+    def toggleBorders(self, evt):
+        self.showBorders = evt.IsChecked()
+
+        if self._map is None:
+            return
+
+        self.map.setShowBorders(self.showBorders)
+        self.pnlMap.plot()
+
+    def toggleLabels(self, evt):
+        self.showLabels = evt.IsChecked()
+
+    def _exportImage(self):
+        # the map as it should be exported (with names, if wanted)
+        if self.showLabels:
+            return self.labelLayer.draw(self.map.img, self.provinces)
+
+        return self.map.img.copy()
+
+    def evt_motion(self, evt):
+        if self._map is None or evt.xdata is None or evt.ydata is None:
+            pID = None
+        else:
+            # pixel centres are at integer coordinates
+            pID = self.map.provinceAt(int(round(evt.ydata)),
+                    int(round(evt.xdata)))
+
+        if pID == self.hoverPID:
+            return
+
+        self.hoverPID = pID
+
+        if pID is None:
+            self.pnlMap.canvas.SetToolTipString('')
+        else:
+            self.pnlMap.canvas.SetToolTipString(self.describeProvince(pID))
+
+    def describeProvince(self, pID):
+        province = self.provinces[pID]
+        owner, controller = province.owner, province.controller
+
+        # the index answers for the map's date without touching the map
+        if self.ownership is not None \
+                and pID in self.ownership.timeline.provinceIds:
+            owner, controller = self.ownership.stateAt(pID, self.map.date)
+
+        # names come from definition.csv, which isn't utf-8
+        name = province.name
+        if isinstance(name, str):
+            name = name.decode('latin-1')
+
+        lines = [u'%s (%d)'%(name, pID)]
+
+        if owner not in (None, '---'):
+            lines.append('Owner: %s'%owner)
+
+        if controller not in (None, '---', owner):
+            lines.append('Controller: %s'%controller)
+
+        # and how long it's been occupied
+        if self.occupations is not None \
+                and pID in self.ownership.timeline.provinceIds:
+            occupation = self.occupations.occupationOf(pID, self.map.date)
+
+            if occupation is not None:
+                start = occupation[3]
+                lines.append('Occupied since %s.%s.%s'%(start.year,
+                    start.month, start.day))
+
+        return u'\n'.join(lines)
+
     def evt_slider(self, evt):
         day = self.sliderDay.GetValue()
         month = self.sliderMonth.GetValue()
@@ -562,6 +883,69 @@ class frmEU4Viewer(wx.Frame):
         self.map.renderAtDate(targetDate)
         self.pnlMap.plot()
 
+    ## Navigation
+    def _promptForTag(self):
+        dlg = wx.TextEntryDialog(self, 'Enter a country tag (eg, SWE)',
+                'Choose Tag', self.navigationTag)
+
+        if dlg.ShowModal() != wx.ID_OK:
+            dlg.Destroy()
+            return
+
+        tag = dlg.GetValue().strip().upper()
+        dlg.Destroy()
+
+        if tag:
+            self.navigationTag = tag
+            return tag
+
+    def navigateNextEvent(self, evt):
+        if self.events is None:
+            return
+
+        self.jumpToDate(self.events.nextEvent(self.map.date))
+
+    def navigatePreviousEvent(self, evt):
+        if self.events is None:
+            return
+
+        self.jumpToDate(self.events.previousEvent(self.map.date))
+
+    def navigateNextTagEvent(self, evt):
+        if self.events is None:
+            return
+
+        tag = self._promptForTag()
+
+        if tag is not None:
+            self.jumpToDate(self.events.nextEventForTag(self.map.date, tag))
+
+    def navigatePreviousTagEvent(self, evt):
+        if self.events is None:
+            return
+
+        tag = self._promptForTag()
+
+        if tag is not None:
+            self.jumpToDate(
+                    self.events.previousEventForTag(self.map.date, tag))
+
+    def jumpToDate(self, date):
+        # there may not be an event to jump to
+        if date is None:
+            return
+
+        date = min(max(date, settings.start_date), settings.end_date)
+
+        self.sliderDay.SetValue(date.day)
+        self.sliderMonth.SetValue(date.month)
+        self.sliderYear.SetValue(date.year)
+
+        self.updateDateLabel(date)
+
+        self.map.renderAtDate(date)
+        self.pnlMap.plot()
+
     def tickDecade(self):
         self.map.tick(EU4Map.DELTA_DECADE)
         self.pnlMap.plot()
@@ -0,0 +1,144 @@
+# Copyright Sean Purdon 2014
+# All Rights Reserved
+
+from datetime import datetime
+from multiprocessing import Pool, cpu_count
+import os
+
+from parsers.countries import add_dynamic_countries
+from parsers.history import extract_save, PROVINCES, COUNTRIES
+from parsers.provinces import get_province_start_states
+
+
+def _extract_save_file((path, startStates)):
+    # runs in a worker process, so must be at module level
+    with open(path, 'rU') as f:
+        return extract_save(f, startStates)
+
+
+def _file_key(path):
+    st = os.stat(path)
+    return (st.st_size, st.st_mtime)
+
+
+class Campaign(object):
+    # Stitches the histories from a series of saves of the same campaign into
+    # a single timeline.
+    #
+    # Save histories lose detail as a game goes on, so earlier saves often
+    # know things that later ones have forgotten.  Events are merged by
+    # (province or tag, date); where two saves disagree about the same event,
+    # the save with the later in-game date wins.
+    #
+    # Each save is only ever extracted once (unless it changes on disk), so
+    # adding a save to the campaign costs one parse plus a merge which is
+    # linear in the number of events in that save.
+
+    def __init__(self, provinces, countries):
+        self.provinces = provinces
+        self.countries = countries
+
+        self.provinceHistories = {}
+        self.countryHistories = {}
+        self.datesWithEvents = {}
+
+        # path -> (file key, extracted save)
+        self._saves = {}
+
+        # (id, date) -> rank of the save the event was last taken from
+        self._ranks = {}
+
+    def __len__(self):
+        return len(self._saves)
+
+    def addSaves(self, paths, processes=None):
+        paths = [p for p in paths
+                if p not in self._saves or self._saves[p][0] != _file_key(p)]
+
+        if not paths:
+            return
+
+        # workers only need the start date owners, not the (large) masks
+        startStates = get_province_start_states(self.provinces)
+        jobs = [(path, startStates) for path in paths]
+
+        if len(jobs) == 1:
+            saves = map(_extract_save_file, jobs)
+        else:
+            if processes is None:
+                processes = min(len(jobs), cpu_count())
+
+            pool = Pool(processes)
+
+            try:
+                saves = pool.map(_extract_save_file, jobs)
+            finally:
+                pool.close()
+                pool.join()
+
+        # a save which changed on disk means merging everything again from
+        # scratch, as we can't tell which of its old events to drop
+        replaced = any(path in self._saves for path in paths)
+
+        for path,save in zip(paths, saves):
+            self._saves[path] = (_file_key(path), save)
+
+            if not replaced:
+                self._merge(save)
+
+        if replaced:
+            self._rebuild()
+
+        self._updateDynamicCountries()
+
+    def _rank(self, save):
+        return save.date if save.date is not None else datetime.min
+
+    def _rebuild(self):
+        self.provinceHistories = {}
+        self.countryHistories = {}
+        self.datesWithEvents = {}
+        self._ranks = {}
+
+        for _,save in self._saves.itervalues():
+            self._merge(save)
+
+    def _merge(self, save):
+        rank = self._rank(save)
+
+        for key,histories,merged in (
+                (PROVINCES, save.provinceHistories, self.provinceHistories),
+                (COUNTRIES, save.countryHistories, self.countryHistories),
+                ):
+            for id,events in histories.iteritems():
+                out = merged.setdefault(id, {})
+
+                for date,event in events.iteritems():
+                    if date not in out:
+                        out[date] = dict(event)
+                        self._ranks[(key, id, date)] = rank
+
+                        if date not in self.datesWithEvents:
+                            self.datesWithEvents[date] = {
+                                    PROVINCES: [],
+                                    COUNTRIES: [],
+                                }
+
+                        self.datesWithEvents[date][key].append(id)
+                    elif rank >= self._ranks[(key, id, date)]:
+                        out[date].update(event)
+                        self._ranks[(key, id, date)] = rank
+                    else:
+                        for k,v in event.iteritems():
+                            out[date].setdefault(k, v)
+
+    def _updateDynamicCountries(self):
+        # apply in save order, so that the latest save decides colours
+        for _,save in sorted(self._saves.itervalues(),
+                key=lambda (_,save): self._rank(save)):
+            add_dynamic_countries(save.dynamicTags, save.subjects,
+                    self.countries)
+
+    def histories(self):
+        return self.provinceHistories, self.countryHistories, \
+                self.datesWithEvents
@@ -2,17 +2,56 @@
 # All Rights Reserved
 
 
+from bisect import bisect_right, insort
+from collections import OrderedDict
+import copy
 from datetime import datetime, timedelta
+from matplotlib import cm
 import numpy as np
+from numpy.lib.stride_tricks import as_strided
 from scipy.misc import imsave
 
+from model.provinces import get_label_map
 import model.settings as settings
+from model.tags import TagTable
+from model.timeline import KIND_START, date_to_ordinal, ordinal_to_date
 import parsers.history as history
 
 
-def get_controller_mask_gen_for_width(width):
-    # diagonal stripes based on array indices
-    return lambda i,j,k: (i + j)%(2*width) < width
+STRIPE_DIAGONAL = 'diagonal'
+STRIPE_ANTIDIAGONAL = 'antidiagonal'
+STRIPE_HORIZONTAL = 'horizontal'
+STRIPE_VERTICAL = 'vertical'
+
+STRIPE_ORIENTATIONS = (STRIPE_DIAGONAL, STRIPE_ANTIDIAGONAL,
+        STRIPE_HORIZONTAL, STRIPE_VERTICAL)
+
+
+def get_stripe_mask(shape, width, orientation=STRIPE_DIAGONAL):
+    # a read-only (height, width) boolean array, True on the stripes
+    #
+    # whichever way they run, stripes only vary along one line through the
+    # image, so the mask is a strided view of a single line of height+width
+    # values rather than an array of its own
+    assert width > 0, 'Invalid stripe width: %s'%width
+    assert orientation in STRIPE_ORIENTATIONS, \
+            'Invalid stripe orientation: %s'%orientation
+
+    line = np.arange(sum(shape))%(2*width) < width
+    step = line.strides[0]
+
+    strides = {
+            STRIPE_HORIZONTAL: (step, 0),
+            STRIPE_VERTICAL: (0, step),
+        }.get(orientation, (step, step))
+
+    mask = as_strided(line, shape=shape, strides=strides)
+
+    if orientation == STRIPE_ANTIDIAGONAL:
+        mask = mask[:,::-1]
+
+    mask.flags.writeable = False
+    return mask
 
 
 class EU4Map(object):
@@ -25,10 +64,22 @@ class EU4Map(object):
     DELTA_YEAR = 'DELTA_YEAR'
     DELTA_DECADE = 'DELTA_DECADE'
 
-    STRIPE_WIDTH = 5
+    HEATMAP_COLOURMAP = 'YlOrRd'
+
+    BORDER_COLOUR = (0, 0, 0)
+
+    # the most days of events the undo log holds
+    UNDO_LOG_LENGTH = 50000
+
+    # when the provinces which need redrawing cover more than this fraction
+    # of the map (going by their bounding boxes), it's quicker to render the
+    # whole map than to paint them one by one
+    FULL_REDRAW_FRACTION = 0.125
 
     def __init__(self, img, provinces, countries, mapObject):
-        self.img = img
+        # the map image may be read-only (eg, mapped from the bitmap), and is
+        # only needed for its size; we draw on our own canvas
+        self.img = np.zeros(img.shape[:2] + (3,), np.uint8)
         self.provinces = provinces
         self.countries = countries
         self.mapObject = mapObject
@@ -36,49 +87,266 @@ class EU4Map(object):
         self.countryHistories = {}
         self.provinceHistories = {}
         self.datesWithEvents = {}
-
-        # controller mask
-        fMask = get_controller_mask_gen_for_width(EU4Map.STRIPE_WIDTH)
-        self.controllerMask = np.fromfunction(fMask, self.img.shape)
-
-        # build original owners and controllers, so they can be restored
-        self.dateCache = {}
-
-        self.dateCache[settings.start_date] = {
-                p.id: (p.controller, p.owner) for p in self.provinces.values()
-            }
+        self.eventDates = []
+        self.ownership = None
+
+        # a loaded Timeline (see loadTimeline), and the map's tag index for
+        # each of its tags
+        self.timeline = None
+        self.timelineTags = None
+
+        # every pixel's province, as an index into the sorted province ids
+        self.labelMap = get_label_map(provinces, self.img.shape[:2])
+        self.provinceIds = self.labelMap.provinceIds
+
+        # colour tables, with an (owner, controller) pair of colours for
+        # each province, and a last (black) pair which unlabelled pixels (-1)
+        # pick up; provinces which aren't occupied have the same colour twice
+        n = len(self.provinceIds)
+
+        self.colourPairs = np.zeros((n + 1, 2, 3), np.uint8)
+        self.ownerColours = self.colourPairs[:,0]
+        self.controllerColours = self.colourPairs[:,1]
+
+        self.lakes = set(mapObject['lakes'])
+        self.seas = set(mapObject['sea_starts'])
+
+        # country borders, drawn over the provinces; borderPixels says which
+        # edge pixels (see LabelMap.adjacency) currently have a border drawn
+        self.showBorders = False
+        self.borderPixels = None
+
+        # lakes and seas never have borders
+        self.borderless = np.zeros(n, bool)
+        self.borderless[self.labelMap.indicesOf(self.lakes | self.seas)] = True
+
+        # occupied provinces are striped with their controllers' colours
+        self._setStripes(settings.stripe_width, settings.stripe_orientation)
+
+        # keyframes hold every province's owner and controller at a date, as
+        # indices into self.tags (aligned with provinceIds)
+        #
+        # they're taken every keyframe_interval days as the history is
+        # replayed, and the least recently used are dropped once they take up
+        # more than keyframe_memory megabytes (except the start date, which
+        # holds the original owners and controllers, and is always kept)
+        #
+        # index 0 is nobody (see TagTable), which provinces get back as None
+        self.tagTable = TagTable()
+        self.tags = self.tagTable.tags
+
+        # the same, for the current date; these are kept up to date as
+        # events are applied, so taking a keyframe is just a copy
+        self.owners = np.zeros(len(self.provinceIds), np.int16)
+        self.controllers = np.zeros(len(self.provinceIds), np.int16)
+        self.syncState(self.provinceIds)
+
+        self.keyframes = OrderedDict()
+        self.keyframeDates = []
+
+        keyframeSize = 2*len(self.provinceIds)*np.dtype(np.int16).itemsize
+        self.maxKeyframes = max(2,
+                settings.keyframe_memory*1024*1024//max(keyframeSize, 1))
+
+        self.storeKeyframe(settings.start_date)
+        self.startKeyframe = self.keyframes[settings.start_date]
+
+        # for each day of events applied since undoBase (in order), the
+        # provinces affected and their previous owners and controllers, so
+        # that we can go backwards by undoing them
+        self.undoBase = settings.start_date
+        self.undoDates = []
+        self.undoLog = []
 
         self.reset()
 
-    def loadSave(self, provinceHistories, countryHistories, datesWithEvents):
+    def loadSave(self, provinceHistories, countryHistories, datesWithEvents,
+            ownership=None):
+        # histories in the form given by build_history (loadTimeline is
+        # quicker, if there's a Timeline to hand)
+        self.timeline = None
+        self.timelineTags = None
+
         self.countryHistories = countryHistories
         self.provinceHistories = provinceHistories
         self.datesWithEvents = datesWithEvents
 
-        # clear everything in the cache except the start date
-        self.dateCache = {
-                settings.start_date: self.dateCache[settings.start_date]
-            }
+        # so we can skip straight from one day with events to the next
+        self.eventDates = sorted(datesWithEvents)
 
+        # if we have an index over the history, it can tell us exactly which
+        # provinces differ between two dates
+        self.ownership = ownership
+
+        self._clearKeyframes()
         self.reset()
 
-    def updateProvincesForDate(self, date):
-        assert date in self.dateCache
+    def loadTimeline(self, timeline, ownership=None):
+        # events are applied straight from the timeline's columns, so a
+        # memory-mapped timeline is never turned back into histories
+        assert np.array_equal(timeline.provinceIds, self.provinceIds)
 
-        dirty = set()
+        self.timeline = timeline
+        self.timelineTags = np.array([self._tagIdx(tag)
+            for tag in timeline.tags], np.int16)
+
+        self.countryHistories = {}
+        self.provinceHistories = {}
+        self.datesWithEvents = {}
+
+        starts = np.asarray(timeline.kinds) == KIND_START
+        dates = np.asarray(timeline.dates)
+
+        self.eventDates = map(ordinal_to_date, np.unique(dates[~starts]))
+        self.ownership = ownership
+
+        # the start state comes from the timeline too, rather than whatever
+        # the provinces held when the map was made
+        owners = self.startKeyframe[0].copy()
+        controllers = self.startKeyframe[1].copy()
+
+        idxs = np.asarray(timeline.provinceIdxs)[starts]
+        owners[idxs] = self.timelineTags[np.asarray(timeline.owners)[starts]]
+        controllers[idxs] = self.timelineTags[
+                np.asarray(timeline.controllers)[starts]]
+
+        self.startKeyframe = (owners, controllers)
+
+        self._clearKeyframes()
+        self.reset()
+
+    def _clearKeyframes(self):
+        # every keyframe except the start date
+        self.keyframes = OrderedDict([(settings.start_date,
+            self.startKeyframe)])
+        self.keyframeDates = [settings.start_date]
+
+    ## Keyframes
+    def _tagIdx(self, tag):
+        return self.tagTable.index(tag)
 
-        for pID,(controller,owner) in self.dateCache[date].iteritems():
+    def syncState(self, pIDs):
+        # brings the owner and controller indices for the provinces into
+        # line with the provinces themselves
+        pIDs = list(pIDs)
+        idxs = np.searchsorted(self.provinceIds, pIDs)
+
+        for i,pID in zip(idxs, pIDs):
             province = self.provinces[pID]
 
-            if province.controller == controller \
-                    and province.owner == owner:
-                continue
+            self.owners[i] = self._tagIdx(province.owner)
+            self.controllers[i] = self._tagIdx(province.controller)
+
+    def keyframeDatesBetween(self, start, end):
+        # dates in (start, end] which should have keyframes
+        interval = settings.keyframe_interval
+
+        first = (start - settings.start_date).days//interval + 1
+        last = (end - settings.start_date).days//interval
+
+        return [settings.start_date + timedelta(days=k*interval)
+                for k in xrange(first, last + 1)]
+
+    def storeKeyframe(self, date):
+        # snapshots the current owners and controllers
+        if date not in self.keyframes:
+            insort(self.keyframeDates, date)
+
+        self.keyframes[date] = (self.owners.copy(), self.controllers.copy())
+
+        # stay within the memory budget
+        while len(self.keyframes) > self.maxKeyframes:
+            for oldest in self.keyframes:
+                if oldest != settings.start_date:
+                    break
+
+            del self.keyframes[oldest]
+            self.keyframeDates.remove(oldest)
+
+    def _leaveKeyframe(self, date):
+        # leave a keyframe to come back to
+        if date not in self.keyframes:
+            self.storeKeyframe(date)
+
+    def nearestKeyframeDate(self, date):
+        # the latest keyframe on or before the date (or the earliest, if
+        # there isn't one)
+        i = bisect_right(self.keyframeDates, date)
+        return self.keyframeDates[max(i - 1, 0)]
 
-            province.controller = controller
-            province.owner = owner
+    def restoreKeyframe(self, date):
+        # sets every province back to a keyframe, and returns those which
+        # changed
+        owners, controllers = self.keyframes.pop(date)
+
+        # it's now the most recently used
+        self.keyframes[date] = (owners, controllers)
+
+        changed = np.flatnonzero((owners != self.owners)
+                | (controllers != self.controllers))
+
+        dirty = set()
+
+        for i in changed:
+            pID = int(self.provinceIds[i])
+            province = self.provinces[pID]
+
+            province.owner = self.tags[owners[i]]
+            province.controller = self.tags[controllers[i]]
 
             dirty.add(pID)
 
+        self.owners[:] = owners
+        self.controllers[:] = controllers
+
+        # there's nothing to undo back to the keyframe
+        self.undoBase = date
+        self.undoDates = []
+        self.undoLog = []
+
+        return dirty
+
+    ## Undo log
+    def logUndo(self, date, pIDs):
+        # records the provinces' owners and controllers before they change
+        idxs = np.searchsorted(self.provinceIds, list(pIDs))
+
+        self.undoDates.append(date)
+        self.undoLog.append((idxs, self.owners[idxs], self.controllers[idxs]))
+
+        # forget the oldest days, past which we'll need keyframes instead
+        if len(self.undoLog) > EU4Map.UNDO_LOG_LENGTH:
+            n = len(self.undoLog) - EU4Map.UNDO_LOG_LENGTH*9//10
+
+            self.undoBase = self.undoDates[n - 1]
+            del self.undoDates[:n]
+            del self.undoLog[:n]
+
+    def undoCost(self, date):
+        # days of events to undo to get back to the date
+        return len(self.undoDates) - bisect_right(self.undoDates, date)
+
+    def undo(self, date):
+        # undoes every day of events after the date, and returns the
+        # provinces affected
+        dirty = set()
+
+        while self.undoDates and self.undoDates[-1] > date:
+            self.undoDates.pop()
+            idxs, owners, controllers = self.undoLog.pop()
+
+            for i,owner,controller in zip(idxs, owners, controllers):
+                pID = int(self.provinceIds[i])
+                province = self.provinces[pID]
+
+                province.owner = self.tags[owner]
+                province.controller = self.tags[controller]
+
+                dirty.add(pID)
+
+            self.owners[idxs] = owners
+            self.controllers[idxs] = controllers
+
         return dirty
 
     def reset(self):
@@ -86,30 +354,20 @@ class EU4Map(object):
         self.date = settings.start_date
 
         # reset province owners
-        self.updateProvincesForDate(settings.start_date)
-
-        # clear the map (everything black)
-        self.img[:] = 0
+        self.restoreKeyframe(settings.start_date)
 
-        # do the provinces
-        for pID in self.provinces:
-            self.drawProvince(pID)
+        # everything is painted over, borders included
+        self.borderPixels = None
+        self.redraw()
 
-        # fill in all the lakes and seas
-        staticElements = [
-                (EU4Map.LAKE_COLOUR, 'lakes'),
-                (EU4Map.SEA_COLOUR, 'sea_starts'),
-                ]
+    def provinceColours(self, pID):
+        # (owner colour, controller colour) for a province
+        if pID in self.lakes:
+            return EU4Map.LAKE_COLOUR, EU4Map.LAKE_COLOUR
 
-        for col,key in staticElements:
-            for pID in self.mapObject[key]:
-                assert pID in self.provinces
-                province = self.provinces[pID]
-
-                self.img[province.maskIdxs] = col
+        if pID in self.seas:
+            return EU4Map.SEA_COLOUR, EU4Map.SEA_COLOUR
 
-    def drawProvince(self, pID):
-        assert pID in self.provinces
         province = self.provinces[pID]
 
         # unowned provinces are uncolonised
@@ -130,16 +388,162 @@ class EU4Map(object):
             
             controllerCol = controller.col
 
-        assert province.maskIdxs is not None, '%s has no mask'%province
-        self.img[province.maskIdxs] = np.where(
-                self.controllerMask[province.maskIdxs], controllerCol, ownerCol)
+        return ownerCol, controllerCol
+
+    def updateColours(self, pIDs):
+        pIDs = list(pIDs)
+        idxs = np.searchsorted(self.provinceIds, pIDs)
+
+        for i,pID in zip(idxs, pIDs):
+            ownerCol, controllerCol = self.provinceColours(pID)
+
+            self.ownerColours[i] = ownerCol
+            self.controllerColours[i] = controllerCol
+
+    def _setStripes(self, width, orientation):
+        # every pixel gets an index into the (flattened) colour pairs: its
+        # province's pair, and which of the two it shows; with these, the
+        # map is drawn by a single gather, whoever owns and controls what
+        #
+        # unlabelled pixels (-1) index from the end, into the black pair
+        labels = self.labelMap.labels
+        n = len(self.provinceIds)
+
+        dtype = np.int16 if 2*(n + 1) <= np.iinfo(np.int16).max else np.int32
+
+        self.stripeMask = get_stripe_mask(labels.shape, width, orientation)
+
+        self.pairIdxs = labels.astype(dtype)
+        self.pairIdxs *= 2
+        self.pairIdxs += self.stripeMask
+
+        self.flatColourPairs = self.colourPairs.reshape(-1, 3)
+
+    def setStripes(self, width, orientation=STRIPE_DIAGONAL):
+        self._setStripes(width, orientation)
+
+        self.render()
+        self.drawBorders()
+
+    def render(self):
+        # draws the whole map from the colour tables
+        np.take(self.flatColourPairs, self.pairIdxs, axis=0, out=self.img)
+
+    def drawProvince(self, pID):
+        assert pID in self.provinces
+
+        self.updateColours([pID])
+        self._paintProvince(pID)
+
+    def _paintProvince(self, pID):
+        # paints a province from the colour tables, touching only its
+        # bounding box
+        i = np.searchsorted(self.provinceIds, pID)
+        slices, mask = self.labelMap.window(i)
+
+        self.img[slices][mask] = self.flatColourPairs[
+                self.pairIdxs[slices][mask]]
+
+    def provinceAt(self, row, col):
+        # the id of the province drawn at a pixel, or None
+        h,w = self.img.shape[:2]
+
+        if not (0 <= row < h and 0 <= col < w):
+            return None
+
+        i = self.labelMap.labels[row, col]
+        return int(self.provinceIds[i]) if i >= 0 else None
+
+    def renderHeatmap(self, values, colourmap=None):
+        # paints each province by value (eg, the number of times it changed
+        # hands), without touching the map's own image
+        #
+        # values must be aligned with the sorted province ids
+        if colourmap is None:
+            colourmap = EU4Map.HEATMAP_COLOURMAP
+
+        assert len(values) == len(self.provinceIds)
+
+        values = np.asarray(values, float)
+        scale = values.max() if len(values) and values.max() > 0 else 1.
+
+        # as with the map's own colour table, unlabelled pixels are black
+        colours = np.zeros((len(values) + 1, 3), np.uint8)
+        colours[:-1] = cm.get_cmap(colourmap)(values/scale)[:,:3]*255
+
+        # lakes and seas keep their usual colours
+        colours[self.labelMap.indicesOf(self.lakes)] = EU4Map.LAKE_COLOUR
+        colours[self.labelMap.indicesOf(self.seas)] = EU4Map.SEA_COLOUR
+
+        return colours[self.labelMap.labels]
 
     def redraw(self, dirty=None):
         if dirty is None:
-            dirty = set(self.provinces)
+            dirty = self.provinceIds
+
+        self.updateColours(dirty)
 
-        for pID in dirty:
-            self.drawProvince(pID)
+        # past a point, painting provinces one at a time costs more than
+        # rendering the whole map
+        bboxes = self.labelMap.bboxes[np.searchsorted(self.provinceIds,
+            list(dirty))].astype(np.int64)
+        area = ((bboxes[:,2] - bboxes[:,0])*(bboxes[:,3] - bboxes[:,1])).sum()
+
+        if area > EU4Map.FULL_REDRAW_FRACTION*self.labelMap.labels.size:
+            self.render()
+        else:
+            for pID in dirty:
+                self._paintProvince(pID)
+
+        self.drawBorders()
+
+    def setShowBorders(self, show):
+        self.showBorders = show
+        self.drawBorders()
+
+    def drawBorders(self):
+        # borders run along edges between provinces with different owners
+        #
+        # comparing owners across every adjacent pair of provinces gives the
+        # edge pixels to paint, which is a single assignment; pixels which
+        # were borders and no longer are get their provinces redrawn
+
+        # nothing to draw, and nothing to clear
+        if not self.showBorders and self.borderPixels is None:
+            return
+
+        pairs, edgeRows, edgeCols, edgePairs = self.labelMap.adjacency
+
+        if self.showBorders:
+            owners = self._borderOwnerIdxs()
+            a, b = owners[pairs[:,0]], owners[pairs[:,1]]
+
+            borderPixels = ((a != b) & (a >= 0) & (b >= 0))[edgePairs]
+        else:
+            borderPixels = np.zeros(len(edgePairs), bool)
+
+        if self.borderPixels is not None:
+            removed = self.borderPixels & ~borderPixels
+
+            if removed.any():
+                labels = self.labelMap.labels[edgeRows[removed],
+                        edgeCols[removed]]
+
+                for i in np.unique(labels):
+                    self._paintProvince(int(self.provinceIds[i]))
+
+        self.img[edgeRows[borderPixels], edgeCols[borderPixels]] \
+                = EU4Map.BORDER_COLOUR
+
+        self.borderPixels = borderPixels if self.showBorders else None
+
+    def _borderOwnerIdxs(self):
+        # an index for each province's owner (aligned with the label map), or
+        # -1 for lakes and seas
+        owners = self.owners.astype(np.int32)
+        owners[self.borderless] = -1
+
+        return owners
 
     def tick(self, delta):
         assert delta \
@@ -159,101 +563,253 @@ class EU4Map(object):
 
         self.renderAtDate(targetDate)
 
-    def renderAtDate(self, targetDate):
-        # first, find the first date we have cached before the target date
-        dayDelta = timedelta(days=1)
-        date = targetDate
+    def applyEvents(self, date):
+        # applies everything which happened on the date, and returns the
+        # provinces affected
+        if self.timeline is not None:
+            return self._applyTimelineEvents(date)
 
-        # before doing this, check that such a date exists
-        earliest = min(self.dateCache)
-        
-        if date <= earliest:
-            date = earliest
-        else:
-            while date not in self.dateCache:
-                date -= dayDelta
+        dirty = set()
 
-        # now, set all provinces back to the target date
-        dirty = self.updateProvincesForDate(date)
+        # either the province has changed hands
+        if history.PROVINCES in self.datesWithEvents[date]:
+            # grab the dirty pIDs
+            pIDs = self.datesWithEvents[date][history.PROVINCES]
+            dirty.update(pIDs)
+
+            # update the actual province objects
+            for pID in pIDs:
+                assert pID in self.provinces
+                assert pID in self.provinceHistories
+                assert date in self.provinceHistories[pID]
+
+                province = self.provinces[pID]
+                event = self.provinceHistories[pID][date]
+
+                if history.CONTROLLER in event:
+                    province.controller = event[history.CONTROLLER]
+
+                if history.OWNER in event:
+                    province.owner = event[history.OWNER]
+
+        # or something has happened to the country
+        if history.COUNTRIES in self.datesWithEvents[date]:
+            # grab the concerned tags
+            tags = self.datesWithEvents[date][history.COUNTRIES]
+
+            # process the events
+            for tag in tags:
+                assert tag in self.countries
+                assert tag in self.countryHistories
+
+                country = self.countries[tag]
+                event = self.countryHistories[tag][date]
+
+                # if we have a tag change, we must set:
+                #  * the owner of all provinces owned by the old tag; and
+                #  * the controller of all provinces controlled by the old
+                #    tag
+                # to the new tag
+                if event[history.EVENT_TYPE] == history.EVENT_TAG_CHANGE:
+                    oldTag = event[history.SOURCE_TAG]
+
+                    ownedPIDs = [pID for pID,p in self.provinces.iteritems()
+                            if p.owner == oldTag]
+
+                    for pID in ownedPIDs:
+                        province = self.provinces[pID]
+                        province.owner = tag
+
+                    controlledPIDs = [pID for pID,p
+                            in self.provinces.iteritems()
+                            if p.controller == oldTag]
+
+                    for pID in controlledPIDs:
+                        province = self.provinces[pID]
+                        province.controller = tag
+
+                    # update the dirty provinces
+                    dirty.update(ownedPIDs)
+                    dirty.update(controlledPIDs)
+
+        self.logUndo(date, dirty)
+        self.syncState(dirty)
+
+        return dirty
+
+    def _applyTimelineEvents(self, date):
+        # the timeline's rows for the date, which have tag changes already
+        # resolved; they're in order, so the last row for a province wins
+        ordinal = date_to_ordinal(date)
+
+        first = np.searchsorted(self.timeline.dates, ordinal, side='left')
+        last = np.searchsorted(self.timeline.dates, ordinal, side='right')
+
+        idxs = np.asarray(self.timeline.provinceIdxs[first:last])
+        owners = self.timelineTags[self.timeline.owners[first:last]]
+        controllers = self.timelineTags[self.timeline.controllers[first:last]]
+
+        dirty = set(self.provinceIds[idxs].tolist())
+        self.logUndo(date, dirty)
+
+        for i,owner,controller in zip(idxs, owners, controllers):
+            province = self.provinces[int(self.provinceIds[i])]
+
+            province.owner = self.tags[owner]
+            province.controller = self.tags[controller]
+
+        self.syncState(dirty)
+
+        return dirty
+
+    def renderAtDate(self, targetDate):
+        previousDate = self.date
+
+        # start from the nearest keyframe before the target date, unless
+        # we're already between it and the target, or going backwards and
+        # it's cheaper to undo what happened since
+        date = self.nearestKeyframeDate(targetDate)
+
+        replayCost = bisect_right(self.eventDates, targetDate) \
+                - bisect_right(self.eventDates, date)
+
+        if date <= self.date <= targetDate:
+            date = self.date
+            dirty = set()
+        elif self.undoBase <= targetDate < self.date \
+                and self.undoCost(targetDate) <= replayCost:
+            dirty = self.undo(targetDate)
+            date = targetDate
+        else:
+            dirty = self.restoreKeyframe(date)
 
         # finally, work out what provinces will need to be redrawn in order
         # to reflect the state of the world at the target date
-        while date < targetDate:
-            date += dayDelta
+        #
+        # only days with events are visited, so this costs nothing for the
+        # days in between
+        first = bisect_right(self.eventDates, date)
+        last = bisect_right(self.eventDates, targetDate)
 
-            # update our set of dirty provinces
-            if date not in self.datesWithEvents:
-                continue
-            
-            # either the province has changed hands
-            if history.PROVINCES in self.datesWithEvents[date]:
-                # grab the dirty pIDs
-                pIDs = self.datesWithEvents[date][history.PROVINCES]
-                dirty = dirty.union(pIDs)
-
-                # update the actual province objects
-                for pID in pIDs:
-                    assert pID in self.provinces
-                    assert pID in self.provinceHistories
-                    assert date in self.provinceHistories[pID]
-
-                    province = self.provinces[pID]
-                    event = self.provinceHistories[pID][date]
-
-                    if history.CONTROLLER in event:
-                        province.controller = event[history.CONTROLLER]
-
-                    if history.OWNER in event:
-                        province.owner = event[history.OWNER]
-
-            # or something has happened to the country
-            if history.COUNTRIES in self.datesWithEvents[date]:
-                # grab the concerned tags
-                tags = self.datesWithEvents[date][history.COUNTRIES]
-
-                # process the events
-                for tag in tags:
-                    assert tag in self.countries
-                    assert tag in self.countryHistories
-
-                    country = self.countries[tag]
-                    event = self.countryHistories[tag][date]
-
-                    # if we have a tag change, we must set:
-                    #  * the owner of all provinces owned by the old tag; and
-                    #  * the controller of all provinces controlled by the
-                    #    old tag
-                    # to the new tag
-                    if event[history.EVENT_TYPE] == history.EVENT_TAG_CHANGE:
-                        oldTag = event[history.SOURCE_TAG]
-
-                        ownedPIDs = [pID for pID,p in self.provinces.iteritems()
-                                if p.owner == oldTag]
-
-                        for pID in ownedPIDs:
-                            province = self.provinces[pID]
-                            province.owner = tag
-
-                        controlledPIDs = [pID for pID,p
-                                in self.provinces.iteritems()
-                                if p.controller == oldTag]
-
-                        for pID in controlledPIDs:
-                            province = self.provinces[pID]
-                            province.controller = tag
-
-                        # update the dirty provinces
-                        pIDs = set(ownedPIDs).union(controlledPIDs)
-                        dirty = dirty.union(pIDs)
-
-            # update the date cache so we can quickly get back to this date
-            self.dateCache[date] = {
-                    p.id: (p.controller, p.owner) 
-                        for p in self.provinces.values()
-                }
+        keyframeDates = self.keyframeDatesBetween(date, targetDate)
+        k = 0
+
+        for eventDate in self.eventDates[first:last]:
+            # keyframes up to here see the state the last event left
+            while k < len(keyframeDates) and keyframeDates[k] < eventDate:
+                self._leaveKeyframe(keyframeDates[k])
+                k += 1
+
+            dirty.update(self.applyEvents(eventDate))
+
+        for keyframeDate in keyframeDates[k:]:
+            self._leaveKeyframe(keyframeDate)
+
+        date = max(date, targetDate)
         
+        # the index gives the net change, which is usually far smaller than
+        # everything touched along the way (especially for long jumps)
+        if self.ownership is not None:
+            dirty = self.ownership.changedBetween(previousDate, date)
+
         # redraw only changed provinces
         self.redraw(dirty)
         
         # set date
         self.date = date
+
+        return dirty
+
+    def dirtyRegion(self, pIDs):
+        # the (top, left, bottom, right) box, exclusive at the bottom and
+        # right, around the provinces (and any borders drawn beside them), or
+        # None if there's nothing there
+        idxs = np.searchsorted(self.provinceIds, list(pIDs))
+        idxs = idxs[self.labelMap.pixelCounts[idxs] > 0]
+
+        if not len(idxs):
+            return None
+
+        bboxes = self.labelMap.bboxes[idxs]
+
+        top, left = bboxes[:,:2].min(axis=0)
+        bottom, right = bboxes[:,2:].max(axis=0)
+
+        # borders may be drawn on the neighbouring pixels
+        if self.showBorders:
+            h,w = self.img.shape[:2]
+            top, left = max(top - 1, 0), max(left - 1, 0)
+            bottom, right = min(bottom + 1, h), min(right + 1, w)
+
+        return int(top), int(left), int(bottom), int(right)
+
+    ## Frames
+    def replay(self):
+        # a copy of the map which can be moved through the history without
+        # disturbing this one; the label map, stripes and history are
+        # shared, but provinces, colours, image and keyframes are its own
+        replay = copy.copy(self)
+
+        replay.provinces = {pID: copy.copy(province)
+                for pID,province in self.provinces.iteritems()}
+
+        replay.img = self.img.copy()
+
+        replay.colourPairs = self.colourPairs.copy()
+        replay.ownerColours = replay.colourPairs[:,0]
+        replay.controllerColours = replay.colourPairs[:,1]
+        replay.flatColourPairs = replay.colourPairs.reshape(-1, 3)
+
+        if self.borderPixels is not None:
+            replay.borderPixels = self.borderPixels.copy()
+
+        replay.tagTable = self.tagTable.copy()
+        replay.tags = replay.tagTable.tags
+        replay.owners = self.owners.copy()
+        replay.controllers = self.controllers.copy()
+
+        # keyframes and undo entries are never changed in place, so only
+        # the containers need copying
+        replay.keyframes = OrderedDict(self.keyframes)
+        replay.keyframeDates = list(self.keyframeDates)
+        replay.undoDates = list(self.undoDates)
+        replay.undoLog = list(self.undoLog)
+
+        return replay
+
+    def frames(self, dates, copyFrames=False, overlay=None):
+        # yields (frame, date, dirty) for each date in turn
+        #
+        # the frames are drawn by a replay (see above), which steps from each
+        # date to the next, so the map itself is left alone; dirty is the
+        # region (see dirtyRegion) which differs from the previous frame, and
+        # covers the whole map for the first
+        #
+        # frames are read-only views of the replay's image, which the next
+        # frame draws over, unless copyFrames is set; if overlay is given,
+        # the frame is overlay(img, provinces) instead, with the replay's
+        # provinces (eg, CountryLabelLayer.draw), and dirty is always the
+        # whole map, since labels move outside the provinces which changed
+        replay = self.replay()
+        h,w = replay.img.shape[:2]
+
+        first = True
+
+        for date in dates:
+            changed = replay.renderAtDate(date)
+
+            if first or overlay is not None:
+                dirty = (0, 0, h, w)
+                first = False
+            else:
+                dirty = replay.dirtyRegion(changed)
+
+            if overlay is not None:
+                frame = overlay(replay.img, replay.provinces)
+            elif copyFrames:
+                frame = replay.img.copy()
+            else:
+                frame = replay.img.view()
+                frame.flags.writeable = False
+
+            yield frame, replay.date, dirty
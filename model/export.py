@@ -0,0 +1,117 @@
+# Copyright Sean Purdon 2014
+# All Rights Reserved
+
+from collections import OrderedDict
+import csv
+import json
+
+from model.timeline import ordinal_to_date, KIND_NAMES, KIND_START
+
+FORMAT_CSV = 'csv'
+FORMAT_NDJSON = 'ndjson'
+
+FORMATS = (FORMAT_CSV, FORMAT_NDJSON)
+
+FIELDS = ('date', 'province_id', 'province_name', 'owner', 'controller',
+        'kind')
+
+OCCUPATION_FIELDS = ('province_id', 'province_name', 'occupier', 'owner',
+        'start', 'end')
+
+# rows are pulled from the (possibly memory-mapped) timeline this many at a
+# time, so memory use doesn't depend on the size of the timeline
+CHUNK_SIZE = 10000
+
+
+def iter_event_records(timeline, provinces, includeStart=False):
+    # yields one tuple (in FIELDS order) per change of owner or controller,
+    # in date order
+    fTag = lambda i: timeline.tags[i] if i else ''
+    fName = lambda pID: provinces[pID].name if pID in provinces else ''
+
+    for start in xrange(0, len(timeline), CHUNK_SIZE):
+        end = start + CHUNK_SIZE
+
+        chunk = zip(
+                timeline.dates[start:end].tolist(),
+                timeline.provinceIdxs[start:end].tolist(),
+                timeline.owners[start:end].tolist(),
+                timeline.controllers[start:end].tolist(),
+                timeline.kinds[start:end].tolist(),
+            )
+
+        for ordinal,i,owner,controller,kind in chunk:
+            if kind == KIND_START and not includeStart:
+                continue
+
+            date = ordinal_to_date(ordinal)
+            pID = int(timeline.provinceIds[i])
+
+            yield (
+                    _date_string(date),
+                    pID,
+                    fName(pID),
+                    fTag(owner),
+                    fTag(controller),
+                    KIND_NAMES[kind],
+                )
+
+
+def _date_string(date):
+    return '%s.%s.%s'%(date.year, date.month, date.day)
+
+
+def iter_occupation_records(occupations, provinces):
+    # yields one tuple (in OCCUPATION_FIELDS order) per occupation, in the
+    # order they started; the end is blank if the occupation never ended
+    fName = lambda pID: provinces[pID].name if pID in provinces else ''
+
+    for pID,occupier,owner,start,end in occupations.spans():
+        yield (
+                pID,
+                fName(pID),
+                occupier,
+                owner,
+                _date_string(start),
+                _date_string(end) if end is not None else '',
+            )
+
+
+def write_csv(f, records, fields=FIELDS):
+    writer = csv.writer(f)
+    writer.writerow(fields)
+
+    for record in records:
+        writer.writerow(record)
+
+
+def write_ndjson(f, records, fields=FIELDS):
+    for record in records:
+        # province names come from definition.csv, which isn't utf-8
+        f.write(json.dumps(OrderedDict(zip(fields, record)),
+            encoding='latin-1'))
+        f.write('\n')
+
+
+def write_events(f, timeline, provinces, format=FORMAT_CSV,
+        includeStart=False):
+    assert format in FORMATS
+
+    records = iter_event_records(timeline, provinces,
+            includeStart=includeStart)
+
+    if format == FORMAT_CSV:
+        write_csv(f, records)
+    else:
+        write_ndjson(f, records)
+
+
+def write_occupations(f, occupations, provinces, format=FORMAT_CSV):
+    assert format in FORMATS
+
+    records = iter_occupation_records(occupations, provinces)
+
+    if format == FORMAT_CSV:
+        write_csv(f, records, fields=OCCUPATION_FIELDS)
+    else:
+        write_ndjson(f, records, fields=OCCUPATION_FIELDS)
@@ -0,0 +1,230 @@
+# Copyright Sean Purdon 2014
+# All Rights Reserved
+
+import numpy as np
+import os
+from PIL import Image, ImageDraw, ImageFont
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+
+from model.tags import TagTable
+
+
+# resolved against the source tree, so it doesn't matter where we're run from
+FONT_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+        os.pardir, 'resources', 'fonts')
+
+
+class CountryLabelLayer(object):
+    # Country names, placed like the in-game political map: one label for
+    # each contiguous piece of a country's territory, centred on the piece's
+    # area-weighted centroid, and sized to fit its width.
+    #
+    # Placements are cached per tag, keyed by the provinces the tag owns, so
+    # only countries whose territory has changed since the last frame are
+    # placed again.  Rendered text is cached per (tag, size), and sizes are
+    # rounded so that the cache actually gets hit.
+
+    FONT = os.path.join(FONT_DIRECTORY, 'Ubuntu-R.ttf')
+    COLOUR = (20, 20, 20)
+
+    MIN_SIZE = 12
+    MAX_SIZE = 72
+    SIZE_STEP = 4
+
+    # fraction of a piece's width the label may cover
+    WIDTH_FRACTION = 0.8
+
+    # text widths are measured once at this size, and scaled
+    REFERENCE_SIZE = 100
+
+    def __init__(self, labelMap, countries, mapObject):
+        self.labelMap = labelMap
+        self.countries = countries
+
+        self.pairs = labelMap.adjacency[0]
+        self.bboxes, self.centroids, self.pixelCounts = labelMap.geometry
+
+        # lakes and seas are never owned
+        self.static = np.zeros(len(labelMap.provinceIds), bool)
+
+        for key in ('lakes', 'sea_starts'):
+            self.static[labelMap.indicesOf(mapObject[key])] = True
+
+        # tag: (owned labels as a string, [(row, column, size)])
+        self.placements = {}
+
+        # (tag, size): (box shape, rows, columns, alpha) for the text's inked
+        # pixels, and tag: width at REFERENCE_SIZE
+        self.texts = {}
+        self.widths = {}
+        self.fonts = {}
+
+    def _font(self, size):
+        if size not in self.fonts:
+            self.fonts[size] = ImageFont.truetype(CountryLabelLayer.FONT, size)
+
+        return self.fonts[size]
+
+    def _name(self, tag):
+        country = self.countries.get(tag)
+        name = country.name if country is not None and country.name else tag
+
+        # names come from file names, which aren't necessarily ascii
+        if isinstance(name, str):
+            name = name.decode('latin-1')
+
+        return name.upper()
+
+    def _text(self, tag, size):
+        key = (tag, size)
+
+        if key not in self.texts:
+            name = self._name(tag)
+            font = self._font(size)
+
+            im = Image.new('L', font.getsize(name))
+            ImageDraw.Draw(im).text((0, 0), name, font=font, fill=255)
+
+            # most of the box is empty, so only the inked pixels are kept
+            alpha = np.asarray(im)
+            rows, cols = np.nonzero(alpha)
+
+            self.texts[key] = (alpha.shape, rows, cols,
+                    alpha[rows, cols].astype(np.float32)/255.)
+
+        return self.texts[key]
+
+    def _widthPerSize(self, tag):
+        if tag not in self.widths:
+            font = self._font(CountryLabelLayer.REFERENCE_SIZE)
+            width = font.getsize(self._name(tag))[0]
+
+            self.widths[tag] = float(width)/CountryLabelLayer.REFERENCE_SIZE
+
+        return self.widths[tag]
+
+    def _ownerIdxs(self, provinces):
+        # an index per label for its owner (0 for nobody), and the tags
+        tags = TagTable()
+
+        owners = np.array([tags.index(provinces[pID].owner)
+            for pID in self.labelMap.provinceIds], np.int32)
+        owners[self.static] = 0
+
+        return owners, tags.tags
+
+    def _components(self, owners):
+        # the connected piece of territory each label belongs to, joining
+        # adjacent provinces with the same owner
+        a, b = self.pairs[:,0], self.pairs[:,1]
+        same = (owners[a] == owners[b]) & (owners[a] != 0)
+
+        n = len(owners)
+        graph = coo_matrix((np.ones(same.sum(), np.int8), (a[same], b[same])),
+                shape=(n, n))
+
+        return connected_components(graph, directed=False)[1]
+
+    def _place(self, tag, labels, components):
+        # [(row, column, size)] for each of the tag's pieces big enough to
+        # hold its name
+        labels = labels[self.pixelCounts[labels] > 0]
+
+        if not len(labels):
+            return []
+
+        pieces, inverse = np.unique(components[labels], return_inverse=True)
+
+        weights = self.pixelCounts[labels].astype(float)
+        areas = np.bincount(inverse, weights)
+
+        rows = np.bincount(inverse, self.centroids[labels,0]*weights)/areas
+        cols = np.bincount(inverse, self.centroids[labels,1]*weights)/areas
+
+        lefts = np.empty(len(pieces))
+        lefts.fill(np.inf)
+        rights = np.zeros(len(pieces))
+
+        np.minimum.at(lefts, inverse, self.bboxes[labels,1])
+        np.maximum.at(rights, inverse, self.bboxes[labels,3])
+
+        sizes = (rights - lefts)*CountryLabelLayer.WIDTH_FRACTION \
+                / max(self._widthPerSize(tag), 1e-6)
+
+        step = CountryLabelLayer.SIZE_STEP
+        sizes = np.minimum(sizes//step*step, CountryLabelLayer.MAX_SIZE)
+
+        return [(row, col, int(size)) for row,col,size in zip(rows, cols, sizes)
+                if size >= CountryLabelLayer.MIN_SIZE]
+
+    def update(self, provinces):
+        # brings the placements up to date with the provinces' owners, and
+        # returns them as {tag: [(row, column, size)]}
+        owners, tags = self._ownerIdxs(provinces)
+
+        # group the labels by owner
+        order = np.argsort(owners, kind='mergesort')
+        starts = np.searchsorted(owners[order], np.arange(len(tags) + 1))
+
+        changed = []
+
+        for i in xrange(1, len(tags)):
+            labels = order[starts[i]:starts[i + 1]]
+            key = labels.tostring()
+
+            if tags[i] not in self.placements \
+                    or self.placements[tags[i]][0] != key:
+                changed.append((tags[i], labels, key))
+
+        if changed:
+            components = self._components(owners)
+
+            for tag,labels,key in changed:
+                self.placements[tag] = (key,
+                        self._place(tag, labels, components))
+
+        # forget countries which no longer exist
+        for tag in set(self.placements).difference(tags):
+            del self.placements[tag]
+
+        return {tag: placements
+                for tag,(_,placements) in self.placements.iteritems()}
+
+    def draw(self, img, provinces):
+        # a copy of the image, with the names of the provinces' owners
+        # drawn over it
+        #
+        # the inked pixels of every label are gathered first, so the whole
+        # layer is blended in one go
+        out = img.copy()
+        h,w = out.shape[:2]
+
+        allRows, allCols, allAlphas = [], [], []
+
+        for tag,placements in self.update(provinces).iteritems():
+            for row,col,size in placements:
+                (th,tw), rows, cols, alpha = self._text(tag, size)
+
+                rows = rows + int(row - th/2.)
+                cols = cols + int(col - tw/2.)
+
+                allRows.append(rows)
+                allCols.append(cols)
+                allAlphas.append(alpha)
+
+        if not allRows:
+            return out
+
+        rows, cols, alpha = map(np.concatenate,
+                (allRows, allCols, allAlphas))
+
+        # clip to the image
+        valid = (rows >= 0) & (rows < h) & (cols >= 0) & (cols < w)
+        rows, cols = rows[valid], cols[valid]
+        alpha = alpha[valid][:,np.newaxis]
+
+        colour = np.array(CountryLabelLayer.COLOUR, np.float32)
+        out[rows, cols, :3] = out[rows, cols, :3]*(1 - alpha) + colour*alpha
+
+        return out
@@ -0,0 +1,80 @@
+# Copyright Sean Purdon 2014
+# All Rights Reserved
+
+import numpy as np
+
+from model.timeline import date_to_ordinal, ordinal_to_date
+
+
+class EventIndex(object):
+    # Sorted event dates, for jumping straight to the next or previous change
+    # of owner or controller.
+    #
+    # As well as the dates of all events, we keep the dates of the events
+    # involving each tag (as the old or new owner or controller), grouped by
+    # tag.  Every lookup is a binary search.
+
+    def __init__(self, ownership):
+        self.tags = ownership.tags
+        self.tagIdxs = ownership.timeline.tagIdxs
+
+        owners = ownership.owners
+        controllers = ownership.controllers
+
+        # the first row of each province is its start state, not an event
+        events = np.flatnonzero(~ownership.isFirstRow)
+        dates = ownership.dates[events]
+
+        self.dates = np.unique(dates)
+
+        # rows are grouped by province, so the previous row is the previous
+        # state of the same province
+        involved = [
+                owners[events],
+                controllers[events],
+                owners[events - 1],
+                controllers[events - 1],
+            ]
+
+        tags = np.concatenate(involved).astype(np.int64)
+        tagDates = np.tile(dates, len(involved)).astype(np.int64)
+
+        valid = tags != 0
+        keys = np.unique((tags[valid] << 32) + tagDates[valid])
+
+        self.tagDates = keys & 0xffffffff
+        tagColumn = keys >> 32
+
+        # dates for tag i are tagDates[tagStarts[i]:tagStarts[i + 1]]
+        self.tagStarts = np.searchsorted(tagColumn,
+                np.arange(len(self.tags) + 1))
+
+    def __len__(self):
+        return len(self.dates)
+
+    def _after(self, dates, date):
+        i = np.searchsorted(dates, date_to_ordinal(date), side='right')
+        return ordinal_to_date(dates[i]) if i < len(dates) else None
+
+    def _before(self, dates, date):
+        i = np.searchsorted(dates, date_to_ordinal(date), side='left')
+        return ordinal_to_date(dates[i - 1]) if i > 0 else None
+
+    def _datesForTag(self, tag):
+        if tag not in self.tagIdxs:
+            return self.tagDates[:0]
+
+        i = self.tagIdxs[tag]
+        return self.tagDates[self.tagStarts[i]:self.tagStarts[i + 1]]
+
+    def nextEvent(self, date):
+        return self._after(self.dates, date)
+
+    def previousEvent(self, date):
+        return self._before(self.dates, date)
+
+    def nextEventForTag(self, date, tag):
+        return self._after(self._datesForTag(tag), date)
+
+    def previousEventForTag(self, date, tag):
+        return self._before(self._datesForTag(tag), date)
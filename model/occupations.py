@@ -0,0 +1,130 @@
+# Copyright Sean Purdon 2014
+# All Rights Reserved
+
+import numpy as np
+
+from model.timeline import date_to_ordinal, ordinal_to_date
+
+# the end of an occupation which hasn't finished by the end of the history
+OPEN = np.iinfo(np.int32).max
+
+
+class OccupationIndex(object):
+    # Every span of time during which a province was controlled by somebody
+    # other than its owner.
+    #
+    # A span starts when a province becomes occupied (or changes occupier),
+    # and ends at the next change of controller, or when the owner takes it
+    # back.  The owner recorded is the owner when the occupation began.
+    #
+    # Spans are found in one vectorised pass over the ownership rows, which
+    # are already grouped by province and sorted by date.
+
+    def __init__(self, ownership):
+        self.ownership = ownership
+        self.provinceIds = ownership.provinceIds
+        self.tags = ownership.tags
+
+        owners = ownership.owners
+        controllers = ownership.controllers
+        n = len(owners)
+
+        first = ownership.isFirstRow
+
+        # uncolonised provinces can't be occupied
+        occupied = (owners != 0) & (controllers != 0) \
+                & (controllers != owners)
+
+        # a new segment starts at each province's first row, and wherever
+        # occupation starts, stops or changes hands
+        breaks = first.copy()
+        breaks[1:] |= (occupied[1:] != occupied[:-1]) \
+                | (controllers[1:] != controllers[:-1])
+
+        segmentStarts = np.flatnonzero(breaks)
+
+        # a segment ends where the next one starts, unless that is the start
+        # of the next province, in which case it never ends
+        nextStarts = np.append(segmentStarts[1:], n)
+        isOpen = (nextStarts == n)
+        isOpen[~isOpen] = first[nextStarts[~isOpen]]
+
+        spans = occupied[segmentStarts]
+        rows = segmentStarts[spans]
+        endRows = nextStarts[spans]
+        isOpen = isOpen[spans]
+
+        self.starts = ownership.dates[rows]
+        self.ends = np.where(isOpen, OPEN,
+                ownership.dates[np.minimum(endRows, n - 1)]).astype(np.int32)
+        self.provinceIdxs = ownership.provinceIdxs[rows]
+        self.occupiers = controllers[rows]
+        self.owners = owners[rows]
+
+    def __len__(self):
+        return len(self.starts)
+
+    def _spans(self, idxs):
+        fTag = lambda i: self.tags[i] if i else None
+        fEnd = lambda end: ordinal_to_date(end) if end != OPEN else None
+
+        return [(int(self.provinceIds[self.provinceIdxs[i]]),
+                 fTag(self.occupiers[i]),
+                 fTag(self.owners[i]),
+                 ordinal_to_date(self.starts[i]),
+                 fEnd(self.ends[i]))
+                for i in idxs]
+
+    def occupiedAt(self, date):
+        # [(pID, occupier, owner, start, end)] for every province occupied
+        # on the date; end is None if the occupation never ended
+        ordinal = date_to_ordinal(date)
+
+        return self._spans(np.flatnonzero(
+                (self.starts <= ordinal) & (ordinal < self.ends)))
+
+    def spans(self):
+        # every occupation, in the order they started
+        return self._spans(np.argsort(self.starts, kind='mergesort'))
+
+    def occupationOf(self, pID, date):
+        # the province's occupation on the date (as in occupiedAt), or None
+        ordinal = date_to_ordinal(date)
+        i = self.ownership.timeline.provinceIndex(pID)
+
+        idxs = np.flatnonzero((self.provinceIdxs == i)
+                & (self.starts <= ordinal) & (ordinal < self.ends))
+
+        return self._spans(idxs)[0] if len(idxs) else None
+
+    def longest(self, n=10, until=None):
+        # the n longest occupations; unfinished ones are measured up to until
+        # (or the last event, if not given)
+        if until is None:
+            ends = self.ownership.dates.max() if len(self.ownership.dates) \
+                    else 0
+        else:
+            ends = date_to_ordinal(until)
+
+        durations = np.where(self.ends == OPEN, ends, self.ends) - self.starts
+        order = np.argsort(-durations, kind='mergesort')[:n]
+
+        return self._spans(order)
+
+    def byOccupier(self, tag):
+        if tag not in self.ownership.timeline.tagIdxs:
+            return []
+
+        i = self.ownership.timeline.tagIdxs[tag]
+        return self._spans(np.flatnonzero(self.occupiers == i))
+
+    def byOwner(self, tag):
+        if tag not in self.ownership.timeline.tagIdxs:
+            return []
+
+        i = self.ownership.timeline.tagIdxs[tag]
+        return self._spans(np.flatnonzero(self.owners == i))
+
+    def forProvince(self, pID):
+        i = self.ownership.timeline.provinceIndex(pID)
+        return self._spans(np.flatnonzero(self.provinceIdxs == i))
@@ -0,0 +1,139 @@
+# Copyright Sean Purdon 2014
+# All Rights Reserved
+
+import numpy as np
+
+from model.timeline import date_to_ordinal, ordinal_to_date
+
+# province indices are shifted into the high bits of a single sort key, with
+# the date ordinal in the low bits
+_KEY_SHIFT = 32
+
+
+class OwnershipIndex(object):
+    # Read-only point-in-time queries over a Timeline.
+    #
+    # The timeline's rows are regrouped by province (keeping date order within
+    # each province), and given a combined (province, date) key.  Any query
+    # for "the state of a province at a date" is then a single binary search
+    # over the keys, and can be done for every province at once.
+    #
+    # Nothing here touches Province objects or the map, so it is safe to use
+    # from scripts, tooltips, or another thread while the map is rendering.
+
+    def __init__(self, timeline):
+        self.timeline = timeline
+        self.provinceIds = timeline.provinceIds
+        self.tags = timeline.tags
+
+        n = len(self.provinceIds)
+
+        # a stable sort keeps the rows for each province in date order
+        order = np.argsort(timeline.provinceIdxs, kind='mergesort')
+
+        self.provinceIdxs = np.asarray(timeline.provinceIdxs)[order]
+        self.dates = np.asarray(timeline.dates)[order]
+        self.owners = np.asarray(timeline.owners)[order]
+        self.controllers = np.asarray(timeline.controllers)[order]
+        self.kinds = np.asarray(timeline.kinds)[order]
+
+        self.keys = (self.provinceIdxs.astype(np.int64) << _KEY_SHIFT) \
+                + self.dates
+
+        # rows for province i are starts[i]:starts[i + 1]
+        self.starts = np.searchsorted(self.provinceIdxs, np.arange(n + 1))
+
+        # the first row of each province is its start state, not a change;
+        # provinces without rows start at the end, so they're left out
+        starts = self.starts[:-1]
+
+        self.isFirstRow = np.zeros(len(self.dates), bool)
+        self.isFirstRow[starts[starts < len(self.dates)]] = True
+
+    def _tag(self, i):
+        return self.tags[i] if i else None
+
+    def _rows(self, pIdxs, ordinal):
+        # the last row for each province on or before the date
+        keys = (np.asarray(pIdxs, np.int64) << _KEY_SHIFT) + ordinal
+        rows = np.searchsorted(self.keys, keys, side='right') - 1
+
+        # before the start date, we can only give the start state
+        return np.maximum(rows, self.starts[pIdxs])
+
+    def _row(self, pID, date):
+        i = self.timeline.provinceIndex(pID)
+        return int(self._rows(np.array([i]), date_to_ordinal(date))[0])
+
+    ## Single province queries
+    def ownerAt(self, pID, date):
+        return self._tag(self.owners[self._row(pID, date)])
+
+    def controllerAt(self, pID, date):
+        return self._tag(self.controllers[self._row(pID, date)])
+
+    def stateAt(self, pID, date):
+        row = self._row(pID, date)
+        return self._tag(self.owners[row]), self._tag(self.controllers[row])
+
+    def ownershipChanges(self, pID):
+        # [(date, previous owner, new owner)] for each time the province
+        # changed hands
+        i = self.timeline.provinceIndex(pID)
+        start, end = self.starts[i], self.starts[i + 1]
+
+        owners = self.owners[start:end]
+        changed = np.flatnonzero(owners[1:] != owners[:-1]) + 1
+
+        return [(ordinal_to_date(self.dates[start + j]),
+                 self._tag(owners[j - 1]), self._tag(owners[j]))
+                for j in changed]
+
+    def datesChangedHands(self, pID):
+        return [date for date,_,_ in self.ownershipChanges(pID)]
+
+    ## All province queries
+    def stateIdxsAt(self, date):
+        # (owners, controllers) tag index arrays, aligned with provinceIds
+        rows = self._rows(np.arange(len(self.provinceIds)),
+                date_to_ordinal(date))
+
+        return self.owners[rows], self.controllers[rows]
+
+    def ownershipChangeCounts(self):
+        # the number of times each province changed hands, aligned with
+        # provinceIds
+        changed = np.zeros(len(self.owners), bool)
+        changed[1:] = self.owners[1:] != self.owners[:-1]
+
+        # a change across the boundary between two provinces doesn't count
+        changed[self.isFirstRow] = False
+
+        return np.bincount(self.provinceIdxs[changed],
+                minlength=len(self.provinceIds))
+
+    ## Date range queries
+    def changedIdxsBetween(self, date1, date2):
+        # indices of provinces whose owner or controller differs between the
+        # two dates (in either order), without looking at the days between
+        owners1, controllers1 = self.stateIdxsAt(date1)
+        owners2, controllers2 = self.stateIdxsAt(date2)
+
+        return np.flatnonzero((owners1 != owners2)
+                | (controllers1 != controllers2))
+
+    def changedBetween(self, date1, date2):
+        return set(int(pID) for pID
+                in self.provinceIds[self.changedIdxsBetween(date1, date2)])
+
+    def ownersAt(self, date):
+        owners,_ = self.stateIdxsAt(date)
+
+        return {int(pID): self._tag(owner)
+                for pID,owner in zip(self.provinceIds, owners)}
+
+    def controllersAt(self, date):
+        _,controllers = self.stateIdxsAt(date)
+
+        return {int(pID): self._tag(controller)
+                for pID,controller in zip(self.provinceIds, controllers)}
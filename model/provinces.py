@@ -4,6 +4,8 @@
 import json
 import numpy as np
 
+from tools.binfile import is_binary_file, read_arrays, write_arrays
+
 
 class Province(object):
     def __init__(self, id, name=u'', rgb=None):
@@ -11,7 +13,12 @@ class Province(object):
         self.name = name
         self.rgb = rgb
 
-        self.maskIdxs = None
+        # the province's pixels come either from its own index arrays, or
+        # from a label map shared by all provinces
+        self._maskIdxs = None
+
+        self.labelMap = None
+        self.index = None
 
         self.owner = None
         self.controller = None
@@ -22,6 +29,74 @@ class Province(object):
     def __repr__(self):
         return 'Province(%d)'%self.id
 
+    @property
+    def maskIdxs(self):
+        # when coming from a label map, these are built from its spans on
+        # every access, and never kept (holding them for every province is
+        # what the label map avoids); use window() or the spans instead
+        if self._fromLabelMap:
+            return self.labelMap.maskIdxs(self.index)
+
+        return self._maskIdxs
+
+    @maskIdxs.setter
+    def maskIdxs(self, val):
+        self._maskIdxs = val
+
+    @property
+    def _fromLabelMap(self):
+        return self._maskIdxs is None and self.labelMap is not None
+
+    def _geometry(self):
+        # (bbox, centroid, pixel count), precomputed if we have a label map
+        if self._fromLabelMap:
+            i = self.index
+            labelMap = self.labelMap
+
+            return (tuple(map(int, labelMap.bboxes[i])),
+                    tuple(labelMap.centroids[i]),
+                    int(labelMap.pixelCounts[i]))
+
+        if self._maskIdxs is None or not len(self._maskIdxs[0]):
+            return (0, 0, 0, 0), (0., 0.), 0
+
+        rows, cols = self._maskIdxs
+
+        return ((int(rows.min()), int(cols.min()),
+                 int(rows.max()) + 1, int(cols.max()) + 1),
+                (rows.mean(), cols.mean()),
+                len(rows))
+
+    @property
+    def bbox(self):
+        # (top, left, bottom, right), where bottom and right are exclusive
+        return self._geometry()[0]
+
+    @property
+    def centroid(self):
+        # (row, column)
+        return self._geometry()[1]
+
+    @property
+    def pixelCount(self):
+        return self._geometry()[2]
+
+    def window(self):
+        # see LabelMap.window
+        if self._fromLabelMap:
+            return self.labelMap.window(self.index)
+
+        top,left,bottom,right = self.bbox
+        slices = (slice(top, bottom), slice(left, right))
+
+        mask = np.zeros((bottom - top, right - left), bool)
+
+        if self._maskIdxs is not None:
+            rows, cols = self._maskIdxs
+            mask[rows - top, cols - left] = True
+
+        return slices, mask
+
     @classmethod
     def fromDict(cls, d):
         assert 'id' in d
@@ -50,23 +125,409 @@ class Province(object):
                 }
 
 
+def compute_spans(labels):
+    # run-length encodes each row of a label image
+    #
+    # returns (spans, spanStarts), where spans is an array of
+    # (row, start column, stop column) for each run of a single label, grouped
+    # by label, and the spans for label i are spans[spanStarts[i]:
+    # spanStarts[i + 1]]
+    h,w = labels.shape
+
+    # a run starts at the start of each row, or wherever the label changes
+    change = np.ones((h, w), bool)
+    change[:,1:] = labels[:,1:] != labels[:,:-1]
+
+    rows, starts = np.nonzero(change)
+
+    # and stops where the next one starts (or at the end of the row)
+    nextRows = np.append(rows[1:], h)
+    nextStarts = np.append(starts[1:], w)
+    stops = np.where(nextRows == rows, nextStarts, w)
+
+    runLabels = labels[rows, starts]
+    valid = runLabels >= 0
+
+    # a stable sort keeps each label's spans in row-major order
+    order = np.argsort(runLabels[valid], kind='mergesort')
+
+    spans = np.column_stack([rows, starts, stops])[valid][order]
+    spans = spans.astype(np.int32)
+
+    n = labels.max() + 1 if labels.size else 0
+    spanStarts = np.searchsorted(runLabels[valid][order], np.arange(n + 1))
+
+    return spans, spanStarts
+
+
+def compute_geometry(spans, spanStarts):
+    # (bboxes, centroids, pixelCounts) for each label, from its spans
+    #
+    # bboxes are (top, left, bottom, right), exclusive at the bottom and
+    # right, and centroids are (row, column)
+    n = len(spanStarts) - 1
+    sizes = np.diff(spanStarts)
+    spanLabels = np.repeat(np.arange(n), sizes)
+
+    spans = np.asarray(spans, np.int64).reshape(-1, 3)
+    rows, starts, stops = spans[:,0], spans[:,1], spans[:,2]
+    lengths = stops - starts
+
+    pixelCounts = np.bincount(spanLabels, lengths, minlength=n)
+    pixelCounts = pixelCounts.astype(np.int64)
+
+    # each label's spans are in row-major order, so its first and last spans
+    # give the top and bottom rows
+    bboxes = np.zeros((n, 4), np.int32)
+    nonEmpty = sizes > 0
+    firsts = spanStarts[:-1][nonEmpty]
+    lasts = spanStarts[1:][nonEmpty] - 1
+
+    if len(firsts):
+        bboxes[nonEmpty,0] = rows[firsts]
+        bboxes[nonEmpty,1] = np.minimum.reduceat(starts, firsts)
+        bboxes[nonEmpty,2] = rows[lasts] + 1
+        bboxes[nonEmpty,3] = np.maximum.reduceat(stops, firsts)
+
+    # a span's columns average to the middle of the span
+    rowSums = np.bincount(spanLabels, rows*lengths, minlength=n)
+    colSums = np.bincount(spanLabels, (starts + stops - 1)*lengths/2.,
+            minlength=n)
+
+    centroids = np.column_stack([rowSums, colSums]) \
+            / np.maximum(pixelCounts, 1)[:,np.newaxis]
+
+    return bboxes, centroids, pixelCounts
+
+
+def compute_adjacency(labels):
+    # the pairs of labels which share a pixel edge, and the pixels along
+    # those edges
+    #
+    # returns (pairs, edgeRows, edgeCols, edgePairs), where pairs holds each
+    # distinct (lower label, higher label) pair, and edge pixel k is at
+    # (edgeRows[k], edgeCols[k]) on the edge of pairs[edgePairs[k]]
+    #
+    # of the two pixels either side of an edge, only the right (or lower) one
+    # is an edge pixel, so borders drawn through them are one pixel wide
+    pieces = []
+
+    for a,b,(dRow,dCol) in (
+            (labels[:,:-1], labels[:,1:], (0, 1)),
+            (labels[:-1,:], labels[1:,:], (1, 0)),
+            ):
+        rows, cols = np.nonzero((a != b) & (a >= 0) & (b >= 0))
+        la, lb = a[rows, cols], b[rows, cols]
+
+        pieces.append((rows + dRow, cols + dCol,
+            np.minimum(la, lb), np.maximum(la, lb)))
+
+    edgeRows, edgeCols, lows, highs = [np.concatenate(c)
+            for c in zip(*pieces)]
+
+    # labels fit in 16 bits, so each pair packs into one key
+    keys = (lows.astype(np.int64) << 16) | highs
+    keys, edgePairs = np.unique(keys, return_inverse=True)
+
+    pairs = np.column_stack([keys >> 16, keys & 0xffff]).astype(np.int32)
+
+    return pairs, edgeRows, edgeCols, edgePairs
+
+
+def spans_to_flat_idxs(spans, width):
+    # expands spans into the flat index of every pixel they cover
+    spans = np.asarray(spans, np.int64).reshape(-1, 3)
+    lengths = spans[:,2] - spans[:,1]
+
+    # each pixel's index is its span's first index, plus how far it is
+    # into the span
+    firsts = spans[:,0]*width + spans[:,1]
+    offsets = np.cumsum(lengths) - lengths
+
+    return np.repeat(firsts - offsets, lengths) + np.arange(lengths.sum())
+
+
+class LabelMap(object):
+    # One int16 image for the whole map, holding the index of each pixel's
+    # province in provinceIds (or -1), plus the same information run-length
+    # encoded per province.
+    #
+    # This is an order of magnitude smaller than holding two int64 index
+    # arrays per province, and the spans are cheap to serialise.  Spans are
+    # optional; if they aren't given, they are worked out from the labels the
+    # first time they are needed.
+
+    def __init__(self, labels, provinceIds, spans=None, spanStarts=None,
+            geometry=None):
+        self.labels = labels
+        self.provinceIds = np.asarray(provinceIds)
+
+        self._spans = spans
+        self._spanStarts = spanStarts
+
+        # (bboxes, centroids, pixelCounts), also worked out when needed
+        self._geometry = geometry
+
+        self._adjacency = None
+
+    @property
+    def shape(self):
+        return self.labels.shape
+
+    def _ensureSpans(self):
+        if self._spans is None:
+            spans, spanStarts = compute_spans(self.labels)
+
+            # provinces with no pixels at the end won't have been seen
+            n = len(self.provinceIds)
+            extra = n + 1 - len(spanStarts)
+
+            if extra > 0:
+                spanStarts = np.append(spanStarts, [len(spans)]*extra)
+
+            self._spans, self._spanStarts = spans, spanStarts
+
+    @property
+    def spans(self):
+        self._ensureSpans()
+        return self._spans
+
+    @property
+    def spanStarts(self):
+        self._ensureSpans()
+        return self._spanStarts
+
+    @property
+    def geometry(self):
+        if self._geometry is None:
+            self._geometry = compute_geometry(self.spans, self.spanStarts)
+
+        return self._geometry
+
+    @property
+    def bboxes(self):
+        return self.geometry[0]
+
+    @property
+    def centroids(self):
+        return self.geometry[1]
+
+    @property
+    def pixelCounts(self):
+        return self.geometry[2]
+
+    @property
+    def adjacency(self):
+        # see compute_adjacency
+        if self._adjacency is None:
+            self._adjacency = compute_adjacency(self.labels)
+
+        return self._adjacency
+
+    def indicesOf(self, pIDs):
+        # the labels of the provinces, all of which must be on the map
+        pIDs = np.asarray(list(pIDs), np.int64)
+        idxs = np.searchsorted(self.provinceIds, pIDs)
+
+        assert (idxs < len(self.provinceIds)).all() \
+                and (self.provinceIds[idxs] == pIDs).all(), \
+                'provinces not on the map: %s'%sorted(
+                        set(pIDs.tolist()).difference(self.provinceIds))
+
+        return idxs
+
+    def window(self, i):
+        # the slices of the map covering label i's bounding box, and a mask of
+        # its pixels within them
+        #
+        # painting through these touches only the bounding box, rather than
+        # indexing the whole map
+        top,left,bottom,right = self.bboxes[i]
+        slices = (slice(top, bottom), slice(left, right))
+
+        return slices, self.labels[slices] == i
+
+    def spansFor(self, i):
+        return self.spans[self.spanStarts[i]:self.spanStarts[i + 1]]
+
+    def flatIdxs(self, i):
+        return spans_to_flat_idxs(self.spansFor(i), self.shape[1])
+
+    def maskIdxs(self, i):
+        return np.unravel_index(self.flatIdxs(i), self.shape)
+
+    def attach(self, provinces):
+        # points each province at this label map
+        for i,pID in enumerate(self.provinceIds):
+            province = provinces[pID]
+
+            province.labelMap = self
+            province.index = i
+            province.maskIdxs = None
+
+
+def get_label_map(provinces, shape=None):
+    # the label map shared by the provinces, if they were built from one,
+    # or a label map painted from each province's own pixels
+    #
+    # either way, the labels line up with the sorted province ids; the shape
+    # of a painted map is the given shape, or just big enough for the pixels
+    pIDs = sorted(provinces)
+    labelMaps = set(p.labelMap for p in provinces.values())
+
+    if len(labelMaps) == 1 and None not in labelMaps:
+        labelMap = labelMaps.pop()
+
+        if list(labelMap.provinceIds) == pIDs \
+                and (shape is None or labelMap.shape == tuple(shape)):
+            return labelMap
+
+    if shape is None:
+        bboxes = [provinces[pID].bbox for pID in pIDs
+                if provinces[pID].pixelCount]
+
+        shape = (max(bottom for _,_,bottom,_ in bboxes) if bboxes else 0,
+                 max(right for _,_,_,right in bboxes) if bboxes else 0)
+
+    labels = np.empty(shape, np.int16)
+    labels.fill(-1)
+
+    for i,pID in enumerate(pIDs):
+        if not provinces[pID].pixelCount:
+            continue
+
+        slices, mask = provinces[pID].window()
+        labels[slices][mask] = i
+
+    return LabelMap(labels, pIDs)
+
+
+class ProvinceHistories(object):
+    # The owner and controller entries from the game's own province history
+    # files, stored as columns sorted by (province, date).
+    #
+    # Undated entries (at the top of a file) are given the earliest possible
+    # date, so that the state at any date is just the last owner entry and
+    # the last controller entry on or before it.  Both are binary searches,
+    # done for every province at once.
+
+    UNDATED = 1 # ordinal of datetime.min
+
+    def __init__(self, tags, owners, controllers):
+        self.tags = tags
+
+        # each of these is a (pIDs, dates, tag indices) tuple
+        self.owners = self._sorted(owners)
+        self.controllers = self._sorted(controllers)
+
+        self.pIDs = np.union1d(self.owners[0], self.controllers[0])
+
+    def _sorted(self, columns):
+        pIDs, dates, tagIdxs = [np.asarray(c, np.int64) for c in columns]
+
+        # a stable sort keeps entries on the same date in file order
+        keys = (pIDs << 32) + dates
+        order = np.argsort(keys, kind='mergesort')
+
+        return pIDs[order], keys[order], tagIdxs[order]
+
+    def _lookup(self, columns, ordinal):
+        pIDs, keys, tagIdxs = columns
+
+        rows = np.searchsorted(keys, (self.pIDs << 32) + ordinal,
+                side='right') - 1
+        found = (rows >= 0) & (pIDs[np.maximum(rows, 0)] == self.pIDs)
+
+        return [self.tags[tagIdxs[row]] if ok else None
+                for row,ok in zip(rows, found)]
+
+    def stateAt(self, date):
+        # {pID: (owner, controller)} as at the date, for every province with
+        # a history file
+        ordinal = date.toordinal()
+
+        owners = self._lookup(self.owners, ordinal)
+        controllers = self._lookup(self.controllers, ordinal)
+
+        return {int(pID): state for pID,state
+                in zip(self.pIDs, zip(owners, controllers))}
+
+
+## Provinces files
+#
+# Provinces files are binary (see tools/binfile.py), holding a province table
+# (ids, names and colours), the label map with its spans, and each province's
+# bounding box, centroid and pixel count, so that loading one is just mapping
+# the arrays.
+#
+# The older json format (a list of province dicts, each with maskIdxs) can
+# still be loaded, so existing files can be converted by loading and saving
+# them again.
+
+MAGIC = 'EU4PROVS'
+VERSION = 1
+
+
 def write_to_file(fn, provinces):
-    arr = []
+    pIDs = sorted(provinces)
+    labelMap = get_label_map(provinces)
 
-    for province in provinces.values():
-        arr.append(province.toDict())
+    # names come from definition.csv, and are stored as raw bytes
+    fName = lambda name: name.encode('latin-1') \
+            if isinstance(name, unicode) else name
 
-    # ocd :)
-    arr.sort(key=lambda d: d['id'])
-            
-    with open(fn, 'w') as f:
-        f.write(json.dumps(arr, encoding='latin-1'))
+    arrays = [
+            ('ids', np.array(pIDs, np.int32)),
+            ('names', np.array([fName(provinces[pID].name) for pID in pIDs],
+                'S')),
+            ('rgbs', np.array([provinces[pID].rgb for pID in pIDs],
+                np.uint8).reshape(-1, 3)),
+            ('labels', labelMap.labels),
+            ('spans', labelMap.spans),
+            ('spanStarts', np.asarray(labelMap.spanStarts, np.int64)),
+            ('bboxes', labelMap.bboxes),
+            ('centroids', labelMap.centroids),
+            ('pixelCounts', labelMap.pixelCounts),
+            ]
 
+    write_arrays(fn, MAGIC, VERSION, {}, arrays)
 
-def load_from_file(fn):
+
+def _load_from_binary_file(fn):
+    _,arrays = read_arrays(fn, MAGIC, VERSION)
+
+    provinces = {}
+
+    for pID,name,rgb in zip(arrays['ids'].tolist(), arrays['names'],
+            arrays['rgbs'].tolist()):
+        provinces[pID] = Province(pID, name, rgb=tuple(rgb))
+
+    # files written before the geometry was stored just work it out again
+    geometry = None
+
+    if 'bboxes' in arrays:
+        geometry = (arrays['bboxes'], arrays['centroids'],
+                arrays['pixelCounts'])
+
+    labelMap = LabelMap(arrays['labels'], arrays['ids'],
+            spans=arrays['spans'], spanStarts=arrays['spanStarts'],
+            geometry=geometry)
+    labelMap.attach(provinces)
+
+    return provinces
+
+
+def _load_from_json_file(fn):
     with open(fn, 'rU') as f:
         arr = json.loads(f.read())
 
     provinces = {p.id: p for p in map(Province.fromDict, arr)}
 
     return provinces
+
+
+def load_from_file(fn):
+    if is_binary_file(fn, MAGIC):
+        return _load_from_binary_file(fn)
+
+    return _load_from_json_file(fn)
@@ -58,6 +58,36 @@ if _d['start_date'] >= _d['end_date']:
 if len(_d['month_names']) != 12:
     raise InvalidSettings('Wrong number of month names')
 
+# optional values get defaults
+_d.setdefault('province_cache_directory', 'province_cache')
+_d.setdefault('keyframe_interval', 365)
+_d.setdefault('keyframe_memory', 64)
+_d.setdefault('stripe_width', 5)
+_d.setdefault('stripe_orientation', 'diagonal')
+
+_fIsInteger = lambda v: isinstance(v, (int, long)) and not isinstance(v, bool)
+_fIsNumber = lambda v: _fIsInteger(v) or isinstance(v, float)
+
+# there must be at least a day between keyframes, and their memory limit
+# can't be negative
+if not _fIsInteger(_d['keyframe_interval']) or _d['keyframe_interval'] <= 0:
+    raise InvalidSettings('Invalid keyframe interval: %s'%(
+        _d['keyframe_interval']))
+
+if not _fIsNumber(_d['keyframe_memory']) or _d['keyframe_memory'] < 0:
+    raise InvalidSettings('Invalid keyframe memory: %s'%(
+        _d['keyframe_memory']))
+
+# stripes must be at least a pixel wide, and run one of the ways the map
+# knows (see STRIPE_ORIENTATIONS in display)
+if not _fIsInteger(_d['stripe_width']) or _d['stripe_width'] <= 0:
+    raise InvalidSettings('Invalid stripe width: %s'%_d['stripe_width'])
+
+if _d['stripe_orientation'] not in ('diagonal', 'antidiagonal', 'horizontal',
+        'vertical'):
+    raise InvalidSettings('Invalid stripe orientation: %s'%(
+        _d['stripe_orientation']))
+
 # convert gif_settings to a Namespace
 _d['gif_settings'] = Namespace(**_d['gif_settings'])
 
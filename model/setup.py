@@ -1,17 +1,34 @@
 # Copyright Sean Purdon 2014
 # All Rights Reserved
 
+import hashlib
 import os
 from matplotlib.pyplot import imread
 from cStringIO import StringIO
 import sys
 
+from model.provinces import load_from_file, write_to_file, \
+        MAGIC as PROVINCES_MAGIC, VERSION as PROVINCES_VERSION
 import model.settings as settings
 from parsers.countries import parse_countries
 from parsers.provinces \
         import parse_province_definitions, parse_province_regions, \
                parse_province_original_owners
 from parsers.files import parse_file
+from tools.binfile import InvalidFile
+from tools.bmp import InvalidBitmap, read_bmp
+
+
+def load_map_image():
+    # the bitmap is mapped straight from disk where possible, rather than
+    # being decoded into memory
+    with settings.mods.mod.mapImageFile as f:
+        try:
+            return read_bmp(f)
+        except InvalidBitmap:
+            pass
+
+    return imread(settings.mods.mod.mapImageFile)
 
 
 def flushed_write(s):
@@ -36,7 +53,7 @@ def setup_data():
 
     # load map
     flushed_write('Loading map file...')
-    img = imread(settings.mods.mod.mapImageFile)
+    img = load_map_image()
     flushed_write('done!\n')
 
     # load map metadata
@@ -56,7 +73,7 @@ def setup_data():
 
 
 def setup_map():
-    img = imread(settings.mods.mod.mapImageFile)
+    img = load_map_image()
 
     with settings.mods.mod.mapSettingsFile as f:
         mapObject = parse_file(f)
@@ -69,9 +86,58 @@ def setup_countries():
     return countries
 
 
-def setup_provinces():
+def get_map_fingerprint():
+    # a hash of the map files (as the mod resolves them) which province data
+    # is built from, along with the version of the provinces file format
+    sha = hashlib.sha1()
+    sha.update('%s %d'%(PROVINCES_MAGIC, PROVINCES_VERSION))
+
+    for fOpen in (lambda: settings.mods.mod.mapImageFile,
+            lambda: settings.mods.mod.open('map', 'definition.csv',
+                mode='rb')):
+        with fOpen() as f:
+            for chunk in iter(lambda: f.read(1 << 20), ''):
+                sha.update(chunk)
+
+    return sha.hexdigest()
+
+
+def get_province_cache_path(fingerprint):
+    return os.path.join(settings.province_cache_directory,
+            fingerprint + '.provinces')
+
+
+def build_provinces():
     provinces = parse_province_definitions()
-    img = imread(settings.mods.mod.mapImageFile)
+    img = load_map_image()
     parse_province_regions(img, provinces)
 
     return provinces
+
+
+def setup_provinces(useCache=True):
+    # province data only depends on the map files, so it is built once for
+    # each distinct map, and loaded from the cache after that
+    if not useCache:
+        return build_provinces()
+
+    path = get_province_cache_path(get_map_fingerprint())
+
+    if os.path.isfile(path):
+        try:
+            return load_from_file(path)
+        except (InvalidFile, IOError, ValueError):
+            pass # rebuild it
+
+    provinces = build_provinces()
+
+    # not being able to write the cache isn't fatal
+    try:
+        if not os.path.isdir(settings.province_cache_directory):
+            os.makedirs(settings.province_cache_directory)
+
+        write_to_file(path, provinces)
+    except (IOError, OSError):
+        pass
+
+    return provinces
@@ -0,0 +1,49 @@
+# Copyright Sean Purdon 2014
+# All Rights Reserved
+
+# what the game (or we) write for a province held by nobody: a missing owner,
+# the '---' controller, or an empty tag
+NOBODY = (None, '', '---')
+
+
+class TagTable(object):
+    # Tags numbered in the order they're first seen, so that owners and
+    # controllers can be held in integer arrays.
+    #
+    # Index 0 is always nobody; every spelling of nobody (see NOBODY) maps to
+    # it, and tags[0] is whichever one the caller wants back.
+
+    def __init__(self, tags=(), nobody=None):
+        self.tags = [nobody]
+        self.idxs = {}
+
+        for tag in tags:
+            self.index(tag)
+
+    def __len__(self):
+        return len(self.tags)
+
+    def index(self, tag):
+        # the tag's index, adding it if it's new
+        if tag in NOBODY:
+            return 0
+
+        if tag not in self.idxs:
+            self.idxs[tag] = len(self.tags)
+            self.tags.append(tag)
+
+        return self.idxs[tag]
+
+    def lookup(self, tag):
+        # the index of a tag which must already be in the table
+        if tag in NOBODY:
+            return 0
+
+        return self.idxs[tag]
+
+    def copy(self):
+        table = TagTable(nobody=self.tags[0])
+        table.tags = list(self.tags)
+        table.idxs = dict(self.idxs)
+
+        return table
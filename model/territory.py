@@ -0,0 +1,181 @@
+# Copyright Sean Purdon 2014
+# All Rights Reserved
+
+from datetime import datetime, timedelta
+import numpy as np
+
+from model.timeline import date_to_ordinal
+
+RESOLUTION_DAY = 'day'
+RESOLUTION_MONTH = 'month'
+RESOLUTION_YEAR = 'year'
+
+RESOLUTIONS = (RESOLUTION_DAY, RESOLUTION_MONTH, RESOLUTION_YEAR)
+
+
+def sample_dates(start, end, resolution):
+    assert resolution in RESOLUTIONS
+
+    if resolution == RESOLUTION_DAY:
+        n = (end - start).days + 1
+        return [start + timedelta(days=i) for i in xrange(n)]
+
+    dates = []
+    y,m = start.year, start.month
+
+    while 1:
+        # clamp the day for short months (eg, starting on the 31st)
+        for d in xrange(start.day, 0, -1):
+            try:
+                date = datetime(y, m, d)
+                break
+            except ValueError:
+                pass
+
+        if date > end:
+            break
+
+        dates.append(date)
+
+        if resolution == RESOLUTION_MONTH:
+            y,m = y + m/12, m%12 + 1
+        else:
+            y += 1
+
+    return dates
+
+
+def province_pixel_counts(timeline, provinces):
+    # the map area of each province, aligned with the timeline's provinces
+    return np.array([provinces[pID].pixelCount
+        for pID in timeline.provinceIds], np.int32)
+
+
+class TerritorySeries(object):
+    # Number of provinces, and map area in pixels, owned by each country at
+    # each of a sequence of dates.
+    #
+    # Rather than replaying the map, every change of owner becomes a -1 for
+    # the old owner and a +1 for the new owner (weighted by pixel count for
+    # areas).  These are binned into the sample dates, and a cumulative sum
+    # over the bins gives the series.  The cost is one pass over the
+    # ownership changes plus one pass over the output.
+    #
+    # Values are only stored for the samples where something changes (most
+    # days of a daily series don't), and are filled forward when queried.
+    # Before the first change, every country has nothing.
+    #
+    # Only tags which owned something at some point get a column.
+
+    # samples filled in at a time when writing CSV
+    CSV_CHUNK = 4096
+
+    def __init__(self, dates, tags, changeIdxs, provinceCounts, pixelAreas):
+        self.dates = dates
+        self.tags = tags
+
+        # ascending indices into dates where any country's holdings change,
+        # and (len(changeIdxs), len(tags)) arrays of the values from each
+        # of them until the next
+        self.changeIdxs = changeIdxs
+        self.provinceCounts = provinceCounts
+        self.pixelAreas = pixelAreas
+
+    @classmethod
+    def fromOwnership(cls, ownership, dates, pixelCounts):
+        owners = ownership.owners
+
+        # the first row of each province establishes the start owner; after
+        # that, we only care about rows where the owner actually changes
+        first = ownership.isFirstRow
+
+        prev = np.empty_like(owners)
+        prev[1:] = owners[:-1]
+
+        rows = np.flatnonzero(first | (owners != prev))
+        isFirst = first[rows]
+
+        # only real countries get a column
+        activeTags = np.unique(owners[owners != 0])
+        columns = np.empty(len(ownership.tags), np.int32)
+        columns.fill(-1)
+        columns[activeTags] = np.arange(len(activeTags))
+
+        # each change lands in the first sample on or after it
+        sampleOrdinals = np.array(map(date_to_ordinal, dates), np.int32)
+        bins = np.searchsorted(sampleOrdinals, ownership.dates[rows])
+        weights = pixelCounts[ownership.provinceIdxs[rows]]
+
+        # gains for the new owner, and losses for the previous one (which
+        # the first row of a province doesn't have)
+        gains = (bins, columns[owners[rows]], 1, weights)
+        losses = (bins[~isFirst], columns[prev[rows][~isFirst]], -1,
+                -weights[~isFirst])
+
+        changes = []
+
+        for b,c,count,area in (gains, losses):
+            valid = (b < len(dates)) & (c >= 0)
+            changes.append((b[valid], c[valid], count, area[valid]))
+
+        # one stored row per sample which has any changes
+        changeIdxs = np.unique(np.concatenate([b for b,_,_,_ in changes]))
+
+        shape = (len(changeIdxs), len(activeTags))
+        provinceCounts = np.zeros(shape, np.int32)
+        pixelAreas = np.zeros(shape, np.int32)
+
+        for b,c,count,area in changes:
+            r = np.searchsorted(changeIdxs, b)
+
+            np.add.at(provinceCounts, (r, c), count)
+            np.add.at(pixelAreas, (r, c), area)
+
+        provinceCounts.cumsum(axis=0, out=provinceCounts)
+        pixelAreas.cumsum(axis=0, out=pixelAreas)
+
+        tags = [ownership.tags[i] for i in activeTags]
+
+        return cls(dates, tags, changeIdxs.astype(np.int32), provinceCounts,
+                pixelAreas)
+
+    def valuesAt(self, sampleIdxs, areas=False):
+        # a (len(sampleIdxs), len(tags)) array, filled forward from the last
+        # change on or before each sample
+        data = self.pixelAreas if areas else self.provinceCounts
+        sampleIdxs = np.asarray(sampleIdxs)
+
+        rows = np.searchsorted(self.changeIdxs, sampleIdxs, 'right') - 1
+        values = np.zeros((len(sampleIdxs), len(self.tags)), data.dtype)
+
+        known = rows >= 0
+        values[known] = data[rows[known]]
+
+        return values
+
+    def writeCSV(self, fn, areas=False):
+        # one row per date, one column per tag
+        fmt = '%d.%d.%d' + ',%d'*len(self.tags) + '\n'
+
+        with open(fn, 'w') as f:
+            f.write(','.join(['date'] + self.tags) + '\n')
+
+            for start in xrange(0, len(self.dates), self.CSV_CHUNK):
+                dates = self.dates[start:start + self.CSV_CHUNK]
+
+                chunk = np.empty((len(dates), 3 + len(self.tags)), np.int32)
+                chunk[:,:3] = [(d.year, d.month, d.day) for d in dates]
+                chunk[:,3:] = self.valuesAt(
+                        np.arange(start, start + len(dates)), areas)
+
+                f.write(''.join(fmt%tuple(row) for row in chunk.tolist()))
+
+    def writeNumpy(self, fn):
+        # stored as is: the values at changeIdxs hold until the next one
+        np.savez(fn,
+                dates=np.array(map(date_to_ordinal, self.dates), np.int32),
+                tags=np.array(self.tags),
+                changeIdxs=self.changeIdxs,
+                provinceCounts=self.provinceCounts,
+                pixelAreas=self.pixelAreas,
+            )
@@ -0,0 +1,309 @@
+# Copyright Sean Purdon 2014
+# All Rights Reserved
+
+from datetime import datetime
+import hashlib
+import numpy as np
+import os
+
+from model.countries import Country
+import model.settings as settings
+from model.tags import TagTable
+from parsers.history import build_history_from_file, PROVINCES, \
+        COUNTRIES, CONTROLLER, OWNER, EVENT_TYPE, EVENT_TAG_CHANGE, SOURCE_TAG
+from parsers.provinces import get_province_start_states
+from tools.binfile import read_arrays, write_arrays, InvalidFile
+
+# Tags are stored as indices into a tag table (see TagTable), where index 0
+# is nobody; this is how nobody is written in the table.
+NO_TAG = ''
+
+# what caused a row in the timeline
+KIND_START = 0
+KIND_PROVINCE = 1
+KIND_TAG_CHANGE = 2
+
+KIND_NAMES = {
+        KIND_START: 'start',
+        KIND_PROVINCE: 'province',
+        KIND_TAG_CHANGE: 'tag_change',
+    }
+
+TIMELINE_EXTENSION = '.timeline'
+
+
+def date_to_ordinal(date):
+    return date.toordinal()
+
+
+def ordinal_to_date(ordinal):
+    return datetime.fromordinal(int(ordinal))
+
+
+class Timeline(object):
+    # A columnar, fully resolved version of the histories from build_history.
+    #
+    # Each row records the state of one province (owner and controller) from
+    # a given date onwards.  There is one KIND_START row per province at the
+    # start date, followed by a row for every later change of state.  Tag
+    # changes are resolved into rows for each province they affect, so the
+    # rows alone are enough to recover the map at any date.
+    #
+    # Rows are sorted by date, and within a date are in the order in which
+    # the viewer applies events (province events, then tag changes).
+    #
+    # Provinces are referred to by their index in provinceIds (which is
+    # sorted), and tags by their index in tags.
+
+    MAGIC = 'EU4TLINE'
+    VERSION = 1
+
+    def __init__(self, provinceIds, tags, dates, provinceIdxs, owners,
+            controllers, kinds, meta=None):
+        self.provinceIds = provinceIds
+        self.tags = tags
+
+        self.dates = dates
+        self.provinceIdxs = provinceIdxs
+        self.owners = owners
+        self.controllers = controllers
+        self.kinds = kinds
+
+        self.meta = meta if meta is not None else {}
+
+        self.tagTable = TagTable(tags[1:], nobody=tags[0])
+        self.tagIdxs = self.tagTable.idxs
+
+    def __len__(self):
+        return len(self.dates)
+
+    def tagIndex(self, tag):
+        return self.tagTable.lookup(tag)
+
+    def provinceIndex(self, pID):
+        i = np.searchsorted(self.provinceIds, pID)
+        assert i < len(self.provinceIds) and self.provinceIds[i] == pID
+
+        return int(i)
+
+    @property
+    def startDate(self):
+        return ordinal_to_date(self.dates[0])
+
+    @classmethod
+    def fromHistories(cls, provinceHistories, countryHistories,
+            datesWithEvents, startStates, startDate, countries=None):
+        provinceIds = np.array(sorted(startStates), np.int32)
+        pIdxs = {pID: i for i,pID in enumerate(provinceIds)}
+
+        tags = TagTable(nobody=NO_TAG)
+        fTagIndex = tags.index
+
+        # start with the state as at the start date
+        startOwners = np.array([fTagIndex(startStates[pID][0])
+            for pID in provinceIds], np.int16)
+        startControllers = np.array([fTagIndex(startStates[pID][1])
+            for pID in provinceIds], np.int16)
+
+        owners = startOwners.copy()
+        controllers = startControllers.copy()
+
+        rows = []
+
+        # replay every later event, in the same order as the viewer does
+        for date in sorted(d for d in datesWithEvents if d > startDate):
+            ordinal = date_to_ordinal(date)
+            dayEvents = datesWithEvents[date]
+
+            for pID in dayEvents.get(PROVINCES, []):
+                assert pID in pIdxs
+                i = pIdxs[pID]
+                event = provinceHistories[pID][date]
+
+                owner, controller = owners[i], controllers[i]
+
+                if CONTROLLER in event:
+                    controller = fTagIndex(event[CONTROLLER])
+
+                if OWNER in event:
+                    owner = fTagIndex(event[OWNER])
+
+                if (owner, controller) == (owners[i], controllers[i]):
+                    continue
+
+                owners[i], controllers[i] = owner, controller
+                rows.append((ordinal, i, owner, controller, KIND_PROVINCE))
+
+            for tag in dayEvents.get(COUNTRIES, []):
+                event = countryHistories[tag][date]
+
+                if event[EVENT_TYPE] != EVENT_TAG_CHANGE:
+                    continue
+
+                oldTag = event[SOURCE_TAG]
+
+                if oldTag not in tags.idxs:
+                    continue # never owned or controlled anything
+
+                old, new = tags.lookup(oldTag), fTagIndex(tag)
+
+                changed = (owners == old) | (controllers == old)
+                owners[owners == old] = new
+                controllers[controllers == old] = new
+
+                for i in np.flatnonzero(changed):
+                    rows.append((ordinal, i, owners[i], controllers[i],
+                        KIND_TAG_CHANGE))
+
+        n = len(provinceIds)
+        columns = zip(*rows) if rows else [(), (), (), (), ()]
+
+        fColumn = lambda start, column, dtype: np.concatenate(
+                [np.asarray(start, dtype), np.array(column, dtype)])
+
+        # keep the colours of every tag, as dynamic countries only exist in
+        # the save
+        meta = {}
+
+        if countries is not None:
+            meta['colours'] = {tag: map(int, countries[tag].col)
+                    for tag in tags.tags
+                    if tag in countries and countries[tag].col}
+
+        return cls(
+                provinceIds,
+                tags.tags,
+                fColumn([date_to_ordinal(startDate)]*n, columns[0], np.int32),
+                fColumn(np.arange(n), columns[1], np.int32),
+                fColumn(startOwners, columns[2], np.int16),
+                fColumn(startControllers, columns[3], np.int16),
+                fColumn([KIND_START]*n, columns[4], np.int8),
+                meta=meta,
+            )
+
+    def restoreCountries(self, countries):
+        # recreates any dynamic countries which were in the original save
+        for tag,col in self.meta.get('colours', {}).iteritems():
+            tag = str(tag)
+
+            if tag not in countries:
+                countries[tag] = Country(tag)
+
+            countries[tag].col = tuple(col)
+
+    def save(self, fn, meta=None):
+        if meta is None:
+            meta = {}
+
+        meta = dict(self.meta, **meta)
+        meta['tags'] = self.tags
+
+        write_arrays(fn, self.MAGIC, self.VERSION, meta, [
+                ('provinceIds', self.provinceIds),
+                ('dates', self.dates),
+                ('provinceIdxs', self.provinceIdxs),
+                ('owners', self.owners),
+                ('controllers', self.controllers),
+                ('kinds', self.kinds),
+            ])
+
+    @classmethod
+    def load(cls, fn):
+        meta, arrays = read_arrays(fn, cls.MAGIC, cls.VERSION)
+
+        tags = map(str, meta.pop('tags'))
+
+        return cls(
+                arrays['provinceIds'],
+                tags,
+                arrays['dates'],
+                arrays['provinceIdxs'],
+                arrays['owners'],
+                arrays['controllers'],
+                arrays['kinds'],
+                meta=meta,
+            )
+
+
+## Timelines stored alongside saves
+
+def get_timeline_path(savePath):
+    return savePath + TIMELINE_EXTENSION
+
+
+def _start_digest(startStates):
+    # a hash of the start state, and the game (and mod) it was read from
+    sha = hashlib.sha1()
+    sha.update(repr((settings.eu4_directory, settings.mods.mods_directory,
+        settings.mods.mod_name)))
+
+    for pID in sorted(startStates):
+        sha.update('%d %r\n'%(pID, startStates[pID]))
+
+    return sha.hexdigest()
+
+
+def _save_key(savePath, startDate, startStates):
+    st = os.stat(savePath)
+
+    return {
+            'saveSize': st.st_size,
+            'saveMtime': st.st_mtime,
+            'startDate': date_to_ordinal(startDate),
+            'startDigest': _start_digest(startStates),
+        }
+
+
+def write_timeline_for_save(savePath, timeline, startDate, startStates):
+    timeline.save(get_timeline_path(savePath),
+            meta=_save_key(savePath, startDate, startStates))
+
+
+def load_timeline_for_save(savePath, startStates, startDate):
+    # returns None if there is no usable timeline for this save
+    path = get_timeline_path(savePath)
+
+    if not os.path.isfile(path):
+        return None
+
+    try:
+        timeline = Timeline.load(path)
+    except (InvalidFile, IOError, ValueError):
+        return None
+
+    # the timeline is stale if the save, the start date, the start state or
+    # the provinces have changed since it was written
+    key = _save_key(savePath, startDate, startStates)
+
+    if any(timeline.meta.get(k) != v for k,v in key.iteritems()):
+        return None
+
+    if not np.array_equal(timeline.provinceIds, sorted(startStates)):
+        return None
+
+    return timeline
+
+
+def get_timeline_for_save(savePath, provinces, countries, startDate):
+    startStates = get_province_start_states(provinces, startDate)
+
+    # if we've seen this save before, its timeline will be next to it
+    timeline = load_timeline_for_save(savePath, startStates, startDate)
+
+    if timeline is not None:
+        timeline.restoreCountries(countries)
+        return timeline
+
+    with open(savePath, 'rU') as f:
+        histories = build_history_from_file(f, startStates, countries)
+
+    timeline = Timeline.fromHistories(*histories, startStates=startStates,
+            startDate=startDate, countries=countries)
+
+    # not being able to write next to the save isn't fatal
+    try:
+        write_timeline_for_save(savePath, timeline, startDate, startStates)
+    except (IOError, OSError):
+        pass
+
+    return timeline
@@ -48,7 +48,7 @@ def parse_country_file(pathComponents, country):
 
 
 def create_dynamic_countries(save, countries):
-    # build lists of masters
+    # build lists of subjects
     assert 'countries' in save
     subjects = { 
             tag : data['subjects'] if 'subjects' in data else []
@@ -56,6 +56,14 @@ def create_dynamic_countries(save, countries):
                 if isinstance(data, dict)
             }
 
+    dynamicTags = save['dynamic_countries'] \
+            if 'dynamic_countries' in save else []
+
+    add_dynamic_countries(dynamicTags, subjects, countries)
+
+
+def add_dynamic_countries(dynamicTags, subjects, countries):
+    # build lists of masters
     masters = {}
 
     for master,subjs in subjects.iteritems():
@@ -63,15 +71,14 @@ def create_dynamic_countries(save, countries):
             masters[subject] = master
 
     # now actually create the country objects
-    if 'dynamic_countries' in save:
-        for tag in save['dynamic_countries']:
-            if tag not in countries:
-                countries[tag] = Country(tag)
-
-            country = countries[tag]
-
-            if tag in masters:
-                master = countries[masters[tag]]
-                country.col = master.col
-            else:
-                country.col = [0, 0, 0]
+    for tag in dynamicTags:
+        if tag not in countries:
+            countries[tag] = Country(tag)
+
+        country = countries[tag]
+
+        if tag in masters:
+            master = countries[masters[tag]]
+            country.col = master.col
+        else:
+            country.col = [0, 0, 0]
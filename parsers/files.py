@@ -3,6 +3,7 @@
 
 from datetime import datetime
 from cStringIO import StringIO
+import re
 
 ## Save Format
 # 
@@ -305,3 +306,144 @@ def parse_file(f, topLevelKeys=None, header=False):
                     break
 
     return d
+
+
+## Token Streams
+#
+# parse_file builds the entire object tree in memory, which is fine for small
+# files but very expensive for saves.  The functions below instead walk the
+# file one line at a time, so that callers can pick out the parts they care
+# about and skip the rest without ever holding the whole tree.
+
+# quoted strings, comments, structural characters, and bare words
+_TOKEN_RE = re.compile(r'"[^"]*"|#[^\n]*|[{}=]|[^\s{}="#]+')
+
+# returned by iter_pairs in place of a value when the value is an object
+OBJECT = object()
+
+
+class TokenStream(object):
+    def __init__(self, f, header=False):
+        if header:
+            f.readline() # consume header
+
+        self._lines = iter(f)
+        self._pending = [] # tokens remaining on the current line, reversed
+
+        self.depth = 0
+
+    def _tokenise(self, line):
+        tokens = [t for t in _TOKEN_RE.findall(line) if not t.startswith('#')]
+        tokens.reverse()
+
+        return tokens
+
+    def next(self):
+        # returns an empty string at EOF, which can never be a real token
+        while not self._pending:
+            line = next(self._lines, None)
+
+            if line is None:
+                return ''
+
+            self._pending = self._tokenise(line)
+
+        token = self._pending.pop()
+
+        if token == '{':
+            self.depth += 1
+        elif token == '}':
+            self.depth -= 1
+
+        return token
+
+    def pushback(self, token):
+        if token == '{':
+            self.depth -= 1
+        elif token == '}':
+            self.depth += 1
+
+        self._pending.append(token)
+
+    def skip_to(self, depth):
+        while self.depth > depth:
+            # whole lines without strings or comments can be skipped just by
+            # counting braces, as long as we don't leave the target depth
+            if not self._pending:
+                line = next(self._lines, None)
+
+                if line is None:
+                    return
+
+                # (we assume every close brace comes first, to be safe)
+                if '"' not in line and '#' not in line:
+                    closes = line.count('}')
+
+                    if self.depth - closes > depth:
+                        self.depth += line.count('{') - closes
+                        continue
+
+                self._pending = self._tokenise(line)
+                continue
+
+            if not self.next():
+                return
+
+
+def iter_pairs(tokens):
+    # yields (key, value) for every assignment in the current object, where
+    # value is either a raw token or OBJECT
+    #
+    # if the value is OBJECT, the caller may walk it with iter_pairs or
+    # iter_values before asking for the next pair; anything it doesn't
+    # consume is skipped
+    depth = tokens.depth
+
+    while 1:
+        tokens.skip_to(depth)
+
+        key = tokens.next()
+
+        if key in ('', '}'):
+            return
+
+        # anonymous objects, eg the extraneous '{ }' blocks found in saves
+        if key == '{':
+            continue
+
+        token = tokens.next()
+
+        # bare values (ie, array elements) aren't assignments
+        if token != '=':
+            tokens.pushback(token)
+            continue
+
+        value = tokens.next()
+
+        if not value:
+            return
+
+        # a key with no value, eg 'key=}'
+        if value == '}':
+            tokens.pushback(value)
+            continue
+
+        yield key, OBJECT if value == '{' else value
+
+
+def iter_values(tokens):
+    # yields every bare value in the current object (ie, array elements)
+    depth = tokens.depth
+
+    while 1:
+        tokens.skip_to(depth)
+
+        token = tokens.next()
+
+        if token in ('', '}'):
+            return
+
+        if token in ('{', '='):
+            continue
+
+        yield token
@@ -3,7 +3,11 @@
 
 from datetime import datetime
 
+from model.namespaces import Namespace
 import model.settings as settings
+from parsers.countries import add_dynamic_countries
+from parsers.files import OBJECT, TokenStream, iter_pairs, iter_values, \
+        parse_token
 
 
 PROVINCES = 'PROVINCES'
@@ -17,7 +21,7 @@ EVENT_TAG_CHANGE = 'EVENT_TAG_CHANGE'
 SOURCE_TAG = 'SOURCE_TAG'
 
 
-def build_history(save, provinces):
+def build_history(save, startStates):
     # first, build up histories for all of the provinces
     provinceHistories = {}
 
@@ -30,11 +34,11 @@ def build_history(save, provinces):
 
         events = provinceHistories[pID] = {}
 
-        assert pID in provinces
-        p = provinces[pID]
+        assert pID in startStates
+        owner, controller = startStates[pID]
 
         # add owner as of start date
-        events[settings.start_date] = {CONTROLLER: p.controller, OWNER: p.owner}
+        events[settings.start_date] = {CONTROLLER: controller, OWNER: owner}
 
         if 'history' not in d:
             continue
@@ -85,33 +89,158 @@ def build_history(save, provinces):
                         SOURCE_TAG: evt['changed_tag_from']
                     }
 
-    # now, build up a dict of all the provinces which had events on a given
-    # day, to save searching later
-    provinceDates = {
-            pID: set(evts) for pID,evts in provinceHistories.iteritems()
-                if evts
-        }
+    datesWithEvents = index_dates_with_events(provinceHistories,
+            countryHistories)
 
-    datesWithProvinceEvents = reduce(set.union, provinceDates.values(), set())
+    return provinceHistories, countryHistories, datesWithEvents
 
-    countryDates = {
-            tag: set(evts) for tag,evts in countryHistories.iteritems()
-                if evts
-        }
 
-    datesWithCountryEvents = reduce(set.union, countryDates.values(), set())
+def index_dates_with_events(provinceHistories, countryHistories):
+    # build up a dict of all the provinces (and countries) which had events on
+    # a given day, to save searching later
+    datesWithEvents = {}
 
-    dates = datesWithProvinceEvents.union(datesWithCountryEvents)
+    for key,histories in ((PROVINCES, provinceHistories),
+            (COUNTRIES, countryHistories)):
+        for id,events in histories.iteritems():
+            for date in events:
+                if date not in datesWithEvents:
+                    datesWithEvents[date] = {PROVINCES: [], COUNTRIES: []}
 
-    datesWithEvents = {
-            date: {
-                    PROVINCES: [pID for pID,eventDates 
-                                in provinceDates.iteritems()
-                                if date in eventDates],
-                    COUNTRIES: [tag for tag,eventDates
-                                in countryDates.iteritems()
-                                if date in eventDates],
-                } for date in dates
-            }
+                datesWithEvents[date][key].append(id)
 
-    return provinceHistories, countryHistories, datesWithEvents
+    return datesWithEvents
+
+
+def extract_save(f, startStates):
+    # walks the save file's token stream once, pulling out only what is
+    # needed to build histories
+    #
+    # unlike parse_file, the save tree is never held in memory, so peak memory
+    # is bounded by the size of the histories rather than the size of the save
+    tokens = TokenStream(f, header=True)
+
+    provinceHistories = {}
+    countryHistories = {}
+    subjects = {}
+    dynamicTags = []
+    date = None
+
+    for key,value in iter_pairs(tokens):
+        if value is not OBJECT:
+            if key == 'date':
+                date = parse_token(value)
+        elif key == 'provinces':
+            _extract_provinces(tokens, startStates, provinceHistories)
+        elif key == 'countries':
+            _extract_countries(tokens, countryHistories, subjects)
+        elif key == 'dynamic_countries':
+            dynamicTags.extend(map(parse_token, iter_values(tokens)))
+
+    return Namespace(
+            date=date,
+            provinceHistories=provinceHistories,
+            countryHistories=countryHistories,
+            subjects=subjects,
+            dynamicTags=dynamicTags,
+        )
+
+
+def _extract_provinces(tokens, startStates, provinceHistories):
+    for nID,value in iter_pairs(tokens):
+        if value is not OBJECT:
+            continue
+
+        pID = -parse_token(nID)
+
+        assert pID in startStates
+        owner, controller = startStates[pID]
+
+        events = provinceHistories[pID] = {}
+
+        # add owner as of start date
+        events[settings.start_date] = {CONTROLLER: controller, OWNER: owner}
+
+        for key,value in iter_pairs(tokens):
+            if key != 'history' or value is not OBJECT:
+                continue
+
+            for date,value in iter_pairs(tokens):
+                # we're interested in date events for province histories
+                date = parse_token(date)
+
+                if not isinstance(date, datetime) or value is not OBJECT:
+                    continue
+
+                out = _extract_province_event(tokens)
+
+                if not out:
+                    continue
+
+                # as with parse_file, EARLIER keys take precedence when a date
+                # is repeated
+                if date in events:
+                    out.update(events[date])
+
+                events[date] = out
+
+
+def _extract_province_event(tokens):
+    out = {}
+
+    for key,value in iter_pairs(tokens):
+        if key == 'owner' and value is not OBJECT:
+            out.setdefault(OWNER, parse_token(value))
+        elif key == 'controller' and value is OBJECT:
+            for k,v in iter_pairs(tokens):
+                if k == 'controller' and v is not OBJECT:
+                    out.setdefault(CONTROLLER, parse_token(v))
+
+    return out
+
+
+def _extract_countries(tokens, countryHistories, subjects):
+    for tag,value in iter_pairs(tokens):
+        # some mods put extra data in the 'countries' dict
+        if value is not OBJECT:
+            continue
+
+        tag = parse_token(tag)
+
+        for key,value in iter_pairs(tokens):
+            if value is not OBJECT:
+                continue
+
+            if key == 'subjects':
+                subjects.setdefault(tag, []).extend(
+                        map(parse_token, iter_values(tokens)))
+            elif key == 'history':
+                events = countryHistories.setdefault(tag, {})
+
+                # NB: currently assume there is only one event per day
+                for date,value in iter_pairs(tokens):
+                    date = parse_token(date)
+
+                    if not isinstance(date, datetime) or value is not OBJECT:
+                        continue
+
+                    for k,v in iter_pairs(tokens):
+                        if k == 'changed_tag_from' and v is not OBJECT \
+                                and date not in events:
+                            events[date] = {
+                                    EVENT_TYPE: EVENT_TAG_CHANGE,
+                                    SOURCE_TAG: parse_token(v),
+                                }
+
+
+def build_history_from_file(f, startStates, countries):
+    # fused equivalent of parse_file, build_history and
+    # create_dynamic_countries, driven straight from the save's token stream
+    save = extract_save(f, startStates)
+
+    add_dynamic_countries(save.dynamicTags, save.subjects, countries)
+
+    datesWithEvents = index_dates_with_events(save.provinceHistories,
+            save.countryHistories)
+
+    return save.provinceHistories, save.countryHistories, datesWithEvents
@@ -1,11 +1,14 @@
 # Copyright Sean Purdon 2014
 # All Rights Reserved
 
+from datetime import datetime
 import numpy as np
 import os
 
-from model.provinces import Province
+from model.provinces import LabelMap, Province, ProvinceHistories
 import model.settings as settings
+from model.tags import TagTable
+from parsers.files import OBJECT, TokenStream, iter_pairs, parse_token
 
 
 def parse_province_definitions():
@@ -29,39 +32,128 @@ def parse_province_definitions():
     return provinces
 
 
+def pack_rgb(r, g, b):
+    # works on scalars or arrays
+    return (np.asarray(r, np.int32) << 16) | (np.asarray(g, np.int32) << 8) \
+            | np.asarray(b, np.int32)
+
+
+def build_label_map(img, provinces):
+    # labels each pixel with the index of its province in sorted(provinces),
+    # or -1 for colours which aren't in the definitions
+    #
+    # each pixel's colour is packed into a single integer, then looked up in
+    # a table covering every possible colour, so the whole image is labelled
+    # in a single pass
+    pIDs = sorted(provinces)
+
+    lut = np.empty(1 << 24, np.int16)
+    lut.fill(-1)
+
+    rgbs = np.array([provinces[pID].rgb for pID in pIDs], np.int32)
+    lut[pack_rgb(rgbs[:,0], rgbs[:,1], rgbs[:,2])] = np.arange(len(pIDs))
+
+    labels = lut[pack_rgb(img[:,:,0], img[:,:,1], img[:,:,2])]
+
+    return labels
+
+
 def parse_province_regions(img, provinces):
-    for i,p in enumerate(provinces.values()):
-        r,g,b = p.rgb
+    # the provinces share a single label map, rather than each holding its
+    # own pixel indices
+    labels = build_label_map(img, provinces)
 
-        p.maskIdxs = np.where(
-                (img[:,:,0] == r) & (img[:,:,1] == g) & (img[:,:,2] == b)
-            )
+    labelMap = LabelMap(labels, sorted(provinces))
+    labelMap.attach(provinces)
 
+    return labelMap
+
+
+def parse_province_histories():
+    # owner and controller entries (dated or not) from history/provinces
+    tags = TagTable()
+    fTagIndex = tags.index
+
+    owners = ([], [], [])
+    controllers = ([], [], [])
+
+    def fAppend(columns, *values):
+        for c,v in zip(columns, values):
+            c.append(v)
 
-def parse_province_original_owners(provinces):
     for f in settings.mods.mod.iterdir('history', 'provinces'):
         # work out what province this is for
         pID = lazy_atoi(os.path.basename(f.name))
 
-        assert pID in provinces
-        province = provinces[pID]
+        tokens = TokenStream(f)
 
-        # now grab the data we want from the file
-        for line in f:
-            if line.startswith('owner'):
-                _,_,owner = line.partition('=')
-                
-                if '#' in owner:
-                    owner = owner[:owner.find('#')]
+        for key,value in iter_pairs(tokens):
+            if value is not OBJECT:
+                if key == 'owner':
+                    fAppend(owners, pID, ProvinceHistories.UNDATED,
+                            fTagIndex(parse_token(value)))
+                elif key == 'controller':
+                    fAppend(controllers, pID, ProvinceHistories.UNDATED,
+                            fTagIndex(parse_token(value)))
+
+                continue
+
+            # everything else we care about is in dated blocks
+            date = parse_token(key)
 
-                province.owner = owner.strip()
-            elif line.startswith('controller'):
-                _,_,controller = line.partition('=')
+            if not isinstance(date, datetime):
+                continue
 
-                if '#' in controller:
-                    controller = controller[:controller.find('#')]
+            for k,v in iter_pairs(tokens):
+                if v is OBJECT:
+                    continue
+
+                if k == 'owner':
+                    fAppend(owners, pID, date.toordinal(),
+                            fTagIndex(parse_token(v)))
+                elif k == 'controller':
+                    fAppend(controllers, pID, date.toordinal(),
+                            fTagIndex(parse_token(v)))
+
+    return ProvinceHistories(tags.tags, owners, controllers)
+
+
+# the history files only need to be parsed once, whatever the start date
+_provinceHistories = None
+
+
+def get_province_histories():
+    global _provinceHistories
+
+    if _provinceHistories is None:
+        _provinceHistories = parse_province_histories()
+
+    return _provinceHistories
+
+
+def get_province_start_states(provinces, date=None):
+    # {pID: (owner, controller)} for every province as at the date (by
+    # default, the start date), straight from the history files
+    #
+    # unlike the provinces' own owners and controllers, this doesn't depend
+    # on whatever date the map is showing
+    if date is None:
+        date = settings.start_date
+
+    states = get_province_histories().stateAt(date)
+    assert all(pID in provinces for pID in states)
+
+    return {pID: states.get(pID, (None, None)) for pID in provinces}
+
+
+def parse_province_original_owners(provinces, date=None):
+    states = get_province_start_states(provinces, date)
+
+    for pID,(owner,controller) in states.iteritems():
+        province = provinces[pID]
 
-                province.controller = controller.strip()
+        province.owner = owner
+        province.controller = controller
 
 
 def lazy_atoi(s):
@@ -2,12 +2,36 @@
 
 import unittest
 
+import tests.model.campaign
+import tests.model.occupations
+import tests.model.ownership
+import tests.model.provinces
+import tests.model.settings
+import tests.model.tags
+import tests.model.territory
+import tests.model.timeline
 import tests.parsers.files
+import tests.parsers.history
+import tests.parsers.provinces
+import tests.tools.binfile
+import tests.tools.bmp
 
 
 def suite():
     return unittest.TestSuite([
+        tests.model.campaign.suite(),
+        tests.model.occupations.suite(),
+        tests.model.ownership.suite(),
+        tests.model.provinces.suite(),
+        tests.model.settings.suite(),
+        tests.model.tags.suite(),
+        tests.model.territory.suite(),
+        tests.model.timeline.suite(),
         tests.parsers.files.suite(),
+        tests.parsers.history.suite(),
+        tests.parsers.provinces.suite(),
+        tests.tools.binfile.suite(),
+        tests.tools.bmp.suite(),
         ])
 
 
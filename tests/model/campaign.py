@@ -0,0 +1,139 @@
+from datetime import datetime
+import os
+from tempfile import mkdtemp
+import shutil
+import unittest
+
+from tests.settings import load_test_settings, use_eu4_directory
+load_test_settings()
+
+from model.campaign import Campaign
+from model.countries import Country
+from model.provinces import Province
+from parsers.history import CONTROLLER, OWNER, PROVINCES
+
+
+def suite():
+    loader = unittest.TestLoader()
+
+    return unittest.TestSuite([
+        loader.loadTestsFromTestCase(CampaignTests),
+        ])
+
+
+START = datetime(1444, 11, 11)
+
+HISTORY_FILES = {
+        os.path.join('history', 'provinces', '1 - Stockholm.txt'):
+            'owner = SWE\ncontroller = SWE\n',
+        os.path.join('history', 'provinces', '2 - Uppland.txt'):
+            'owner = SWE\ncontroller = SWE\n',
+    }
+
+SAVE = '''EU4txt
+date=%s
+provinces={
+-1={
+	history={
+%s
+	}
+}
+}
+countries={
+}
+'''
+
+# the earlier save remembers who controlled province 1 in 1450, and an event
+# in 1455 which the later one has forgotten, but disagrees with it about the
+# owner in 1450
+EARLY = SAVE%('1460.1.1', '''
+		1450.1.1={
+			owner="FIN"
+			controller={
+				controller="FIN"
+			}
+		}
+		1455.1.1={
+			owner="DAN"
+		}''')
+
+LATE = SAVE%('1470.1.1', '''
+		1450.1.1={
+			owner="NOR"
+		}''')
+
+
+class CampaignTests(unittest.TestCase):
+    def setUp(self):
+        use_eu4_directory(self, HISTORY_FILES)
+
+        self.dir = mkdtemp()
+        self.early = self._write('early.eu4', EARLY)
+        self.late = self._write('late.eu4', LATE)
+
+        self.provinces = {pID: Province(pID) for pID in (1, 2)}
+        self.countries = {tag: Country(tag) for tag in ('SWE', 'FIN', 'NOR')}
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _write(self, name, contents):
+        fn = os.path.join(self.dir, name)
+
+        with open(fn, 'w') as f:
+            f.write(contents)
+
+        return fn
+
+    def _campaign(self, *paths):
+        campaign = Campaign(self.provinces, self.countries)
+
+        for path in paths:
+            campaign.addSaves([path])
+
+        return campaign
+
+    def testLaterSaveWins(self):
+        # whichever order the saves are added in
+        for paths in ((self.early, self.late), (self.late, self.early)):
+            campaign = self._campaign(*paths)
+            events = campaign.provinceHistories[1]
+
+            # the later save's owner, but the earlier save's controller, as
+            # the later save doesn't say
+            self.assertEqual(events[datetime(1450, 1, 1)],
+                    {OWNER: 'NOR', CONTROLLER: 'FIN'})
+            self.assertEqual(events[datetime(1455, 1, 1)], {OWNER: 'DAN'})
+            self.assertEqual(events[START], {OWNER: 'SWE', CONTROLLER: 'SWE'})
+
+            self.assertEqual(
+                    campaign.datesWithEvents[datetime(1450, 1, 1)][PROVINCES],
+                    [1])
+
+    def testUnchangedSaveIsSkipped(self):
+        campaign = self._campaign(self.early, self.late, self.early)
+
+        self.assertEqual(len(campaign), 2)
+        self.assertEqual(campaign.datesWithEvents[START][PROVINCES], [1])
+
+    def testChangedSaveRebuilds(self):
+        campaign = self._campaign(self.early, self.late)
+
+        # the earlier save is overwritten with a different game state
+        self._write('early.eu4', SAVE%('1461.1.1', '''
+		1456.1.1={
+			owner="DAN"
+		}'''))
+        campaign.addSaves([self.early])
+
+        events = campaign.provinceHistories[1]
+
+        # nothing is kept from the old version of the save
+        self.assertEqual(sorted(events),
+                [START, datetime(1450, 1, 1), datetime(1456, 1, 1)])
+        self.assertEqual(events[datetime(1450, 1, 1)], {OWNER: 'NOR'})
+
+        # and nothing is merged twice
+        self.assertEqual(len(campaign), 2)
+        self.assertEqual(campaign.datesWithEvents[START][PROVINCES], [1])
+        self.assertNotIn(datetime(1455, 1, 1), campaign.datesWithEvents)
@@ -0,0 +1,109 @@
+from datetime import datetime
+from StringIO import StringIO
+import unittest
+
+from tests.model.timelines import make_timeline, START
+
+from model.export import write_occupations
+from model.occupations import OccupationIndex
+from model.ownership import OwnershipIndex
+from model.provinces import Province
+from model.timeline import KIND_START, KIND_PROVINCE
+
+
+def suite():
+    loader = unittest.TestLoader()
+
+    return unittest.TestSuite([
+        loader.loadTestsFromTestCase(OccupationIndexTests),
+        ])
+
+
+class OccupationIndexTests(unittest.TestCase):
+    TAGS = ['', 'SWE', 'DAN', 'NOR']
+
+    # (date, province index, owner, controller, kind)
+    ROWS = [
+            (START, 0, 1, 1, KIND_START),
+            (START, 1, 3, 3, KIND_START),
+            (START, 2, 0, 0, KIND_START),
+
+            # province 1 is occupied by DAN, then NOR, then freed; later, DAN
+            # takes it again, for good
+            (datetime(1450, 1, 1), 0, 1, 2, KIND_PROVINCE),
+            (datetime(1451, 1, 1), 0, 1, 3, KIND_PROVINCE),
+            (datetime(1452, 1, 1), 0, 1, 1, KIND_PROVINCE),
+            (datetime(1460, 1, 1), 0, 1, 2, KIND_PROVINCE),
+
+            # province 5 is occupied by SWE, then ceded to it
+            (datetime(1455, 1, 1), 1, 3, 1, KIND_PROVINCE),
+            (datetime(1456, 1, 2), 1, 1, 1, KIND_PROVINCE),
+
+            # uncolonised provinces can't be occupied
+            (datetime(1470, 1, 1), 2, 0, 2, KIND_PROVINCE),
+        ]
+
+    def setUp(self):
+        timeline = make_timeline(self.TAGS, sorted(self.ROWS))
+        self.occupations = OccupationIndex(OwnershipIndex(timeline))
+
+    def testSpans(self):
+        self.assertEqual(len(self.occupations), 4)
+
+        self.assertEqual(self.occupations.spans(), [
+                (1, 'DAN', 'SWE', datetime(1450, 1, 1), datetime(1451, 1, 1)),
+                (1, 'NOR', 'SWE', datetime(1451, 1, 1), datetime(1452, 1, 1)),
+                (5, 'SWE', 'NOR', datetime(1455, 1, 1), datetime(1456, 1, 2)),
+                (1, 'DAN', 'SWE', datetime(1460, 1, 1), None),
+            ])
+
+    def testOccupiedAt(self):
+        fOccupied = lambda date: [span[:3]
+                for span in self.occupations.occupiedAt(date)]
+
+        self.assertEqual(fOccupied(START), [])
+        self.assertEqual(fOccupied(datetime(1450, 6, 1)), [(1, 'DAN', 'SWE')])
+        self.assertEqual(fOccupied(datetime(1455, 6, 1)), [(5, 'SWE', 'NOR')])
+
+        # occupations end on the day control changes
+        self.assertEqual(fOccupied(datetime(1452, 1, 1)), [])
+
+        # and unfinished ones go on forever
+        self.assertEqual(fOccupied(datetime(1821, 1, 1)), [(1, 'DAN', 'SWE')])
+
+    def testOccupationOf(self):
+        occupation = self.occupations.occupationOf(1, datetime(1451, 6, 1))
+        self.assertEqual(occupation[1], 'NOR')
+
+        self.assertEqual(self.occupations.occupationOf(5, START), None)
+        self.assertEqual(self.occupations.occupationOf(9,
+            datetime(1480, 1, 1)), None)
+
+    def testLongest(self):
+        longest = self.occupations.longest(n=2, until=datetime(1470, 1, 1))
+
+        self.assertEqual([(pID, start) for pID,_,_,start,_ in longest],
+                [(1, datetime(1460, 1, 1)), (5, datetime(1455, 1, 1))])
+
+    def testByTag(self):
+        self.assertEqual([span[3] for span in
+            self.occupations.byOccupier('DAN')],
+            [datetime(1450, 1, 1), datetime(1460, 1, 1)])
+        self.assertEqual([span[0] for span in self.occupations.byOwner('NOR')],
+                [5])
+
+        self.assertEqual(self.occupations.byOccupier('SCA'), [])
+        self.assertEqual(self.occupations.forProvince(9), [])
+
+    def testWriteOccupations(self):
+        provinces = {pID: Province(pID, 'p%d'%pID) for pID in (1, 5, 9)}
+
+        f = StringIO()
+        write_occupations(f, self.occupations, provinces)
+
+        lines = f.getvalue().splitlines()
+
+        self.assertEqual(lines[0],
+                'province_id,province_name,occupier,owner,start,end')
+        self.assertEqual(lines[1], '1,p1,DAN,SWE,1450.1.1,1451.1.1')
+        self.assertEqual(lines[-1], '1,p1,DAN,SWE,1460.1.1,')
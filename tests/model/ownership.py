@@ -0,0 +1,106 @@
+from datetime import datetime
+import unittest
+
+from tests.model.timelines import make_timeline, START, TAGS, ROWS
+
+from model.ownership import OwnershipIndex
+
+
+def suite():
+    loader = unittest.TestLoader()
+
+    return unittest.TestSuite([
+        loader.loadTestsFromTestCase(OwnershipIndexTests),
+        ])
+
+
+class OwnershipIndexTests(unittest.TestCase):
+    # see tests.model.timelines for the history
+
+    def setUp(self):
+        self.ownership = OwnershipIndex(make_timeline(TAGS, ROWS))
+
+    def testStateAt(self):
+        fState = self.ownership.stateAt
+
+        self.assertEqual(fState(1, START), ('SWE', 'SWE'))
+        self.assertEqual(fState(1, datetime(1449, 12, 31)), ('SWE', 'SWE'))
+        self.assertEqual(fState(1, datetime(1450, 1, 1)), ('SWE', 'DAN'))
+        self.assertEqual(fState(1, datetime(1452, 6, 1)), ('DAN', 'DAN'))
+        self.assertEqual(fState(5, datetime(1452, 5, 31)), ('NOR', 'NOR'))
+        self.assertEqual(fState(5, datetime(1452, 6, 1)), ('SCA', 'SCA'))
+
+    def testSameDayRows(self):
+        date = datetime(1460, 3, 1)
+
+        self.assertEqual(self.ownership.stateAt(1, date), ('SWE', 'SWE'))
+        self.assertEqual(self.ownership.ownerAt(1, date), 'SWE')
+        self.assertEqual(self.ownership.controllerAt(1, date), 'SWE')
+
+    def testBeforeStart(self):
+        # only the start state is known before the start date
+        date = datetime(1400, 1, 1)
+
+        self.assertEqual(self.ownership.stateAt(1, date), ('SWE', 'SWE'))
+        self.assertEqual(self.ownership.stateAt(5, date), ('NOR', 'NOR'))
+        self.assertEqual(self.ownership.stateAt(9, date), (None, None))
+
+    def testAfterLastEvent(self):
+        date = datetime(1821, 1, 1)
+
+        self.assertEqual(self.ownership.stateAt(1, date), ('SWE', 'SWE'))
+        self.assertEqual(self.ownership.stateAt(5, date), ('SCA', 'SCA'))
+
+    def testProvinceWithoutEvents(self):
+        for date in (START, datetime(1452, 6, 1), datetime(1821, 1, 1)):
+            self.assertEqual(self.ownership.stateAt(9, date), (None, None))
+
+        self.assertEqual(self.ownership.ownershipChanges(9), [])
+        self.assertEqual(self.ownership.datesChangedHands(9), [])
+
+    def testOwnershipChanges(self):
+        # occupation isn't a change of hands, and neither is a row which
+        # doesn't change the owner
+        self.assertEqual(self.ownership.ownershipChanges(1), [
+                (datetime(1452, 6, 1), 'SWE', 'DAN'),
+                (datetime(1460, 3, 1), 'DAN', 'SWE'),
+            ])
+        self.assertEqual(self.ownership.datesChangedHands(5),
+                [datetime(1452, 6, 1)])
+
+    def testStateIdxsAt(self):
+        owners, controllers = self.ownership.stateIdxsAt(
+                datetime(1451, 1, 1))
+
+        self.assertEqual(owners.tolist(), [1, 3, 0])
+        self.assertEqual(controllers.tolist(), [2, 3, 0])
+
+        self.assertEqual(self.ownership.ownersAt(datetime(1455, 1, 1)),
+                {1: 'DAN', 5: 'SCA', 9: None})
+        self.assertEqual(self.ownership.controllersAt(datetime(1451, 1, 1)),
+                {1: 'DAN', 5: 'NOR', 9: None})
+
+    def testIsFirstRow(self):
+        # rows are grouped by province: five, then two, then one
+        self.assertEqual(self.ownership.isFirstRow.tolist(),
+                [True, False, False, False, False, True, False, True])
+
+    def testOwnershipChangeCounts(self):
+        self.assertEqual(self.ownership.ownershipChangeCounts().tolist(),
+                [2, 1, 0])
+
+    def testChangedBetween(self):
+        fChanged = self.ownership.changedBetween
+
+        self.assertEqual(fChanged(START, datetime(1449, 1, 1)), set())
+        self.assertEqual(fChanged(START, datetime(1450, 1, 1)), set([1]))
+        self.assertEqual(fChanged(datetime(1450, 1, 1), datetime(1453, 1, 1)),
+                set([1, 5]))
+
+        # the order of the dates doesn't matter
+        self.assertEqual(fChanged(datetime(1453, 1, 1), datetime(1450, 1, 1)),
+                set([1, 5]))
+
+        # province 1 is back where it started, so only 5 differs
+        self.assertEqual(fChanged(START, datetime(1470, 1, 1)), set([5]))
+        self.assertEqual(fChanged(datetime(1470, 1, 1), START), set([5]))
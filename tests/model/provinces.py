@@ -0,0 +1,138 @@
+import json
+import numpy as np
+import os
+from tempfile import mkdtemp
+import shutil
+import unittest
+
+from model.provinces import LabelMap, Province, compute_spans, \
+        load_from_file, write_to_file
+
+
+def suite():
+    loader = unittest.TestLoader()
+
+    return unittest.TestSuite([
+        loader.loadTestsFromTestCase(LabelMapTests),
+        ])
+
+
+class LabelMapTests(unittest.TestCase):
+    LABELS = np.array([
+            [0, 0, 1, 1, -1],
+            [0, 2, 2, 1, 1],
+            [-1, 2, 2, 2, 0],
+        ], np.int16)
+
+    def setUp(self):
+        self.dir = mkdtemp()
+        self.fn = os.path.join(self.dir, 'provinces.txt')
+
+        # the last province has no pixels
+        self.provinces = {pID: Province(pID, rgb=(pID, 0, 0))
+                for pID in (1, 5, 9, 12)}
+
+        self.labelMap = LabelMap(self.LABELS, sorted(self.provinces))
+        self.labelMap.attach(self.provinces)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def testSpans(self):
+        spans,spanStarts = compute_spans(self.LABELS)
+
+        self.assertEqual(spans[spanStarts[0]:spanStarts[1]].tolist(),
+                [[0, 0, 2], [1, 0, 1], [2, 4, 5]])
+        self.assertEqual(spans[spanStarts[1]:spanStarts[2]].tolist(),
+                [[0, 2, 4], [1, 3, 5]])
+
+    def testMaskIdxsMatchLabels(self):
+        for i,pID in enumerate(sorted(self.provinces)):
+            expected = np.where(self.LABELS == i)
+            rows,cols = self.provinces[pID].maskIdxs
+
+            self.assertTrue(np.array_equal(rows, expected[0]))
+            self.assertTrue(np.array_equal(cols, expected[1]))
+
+    def testMaskIdxsFollowLabelMap(self):
+        province = self.provinces[5]
+
+        # the indices aren't kept, so attaching a new label map changes them
+        labelMap = LabelMap(self.LABELS[::-1], sorted(self.provinces))
+        labelMap.attach(self.provinces)
+
+        rows,cols = province.maskIdxs
+        expected = np.where(self.LABELS[::-1] == 1)
+        self.assertTrue(np.array_equal(rows, expected[0]))
+        self.assertTrue(np.array_equal(cols, expected[1]))
+
+    def testIndicesOf(self):
+        self.assertEqual(self.labelMap.indicesOf([12, 1, 9]).tolist(),
+                [3, 0, 2])
+        self.assertEqual(self.labelMap.indicesOf(set()).tolist(), [])
+
+        # between ids, and past the last one
+        self.assertRaises(AssertionError, self.labelMap.indicesOf, [1, 6])
+        self.assertRaises(AssertionError, self.labelMap.indicesOf, [13])
+
+    def testFileRoundTrip(self):
+        write_to_file(self.fn, self.provinces)
+        provinces = load_from_file(self.fn)
+
+        labelMap = provinces[1].labelMap
+        self.assertTrue(np.array_equal(labelMap.labels, self.LABELS))
+
+        for pID in self.provinces:
+            for a,b in zip(provinces[pID].maskIdxs,
+                    self.provinces[pID].maskIdxs):
+                self.assertTrue(np.array_equal(a, b))
+
+    def testLegacyFileLoads(self):
+        # old json files are a list with explicit pixel indices
+        with open(self.fn, 'w') as f:
+            f.write(json.dumps([{'id': 1, 'name': 'Stockholm', 'rgb': [1, 0, 0],
+                'maskIdxs': [[0, 1], [0, 0]]}]))
+
+        provinces = load_from_file(self.fn)
+
+        self.assertEqual(provinces[1].name, 'Stockholm')
+        self.assertEqual(map(list, provinces[1].maskIdxs), [[0, 1], [0, 0]])
+
+    def testGeometry(self):
+        for i,pID in enumerate(sorted(self.provinces)):
+            province = self.provinces[pID]
+            rows,cols = np.where(self.LABELS == i)
+
+            self.assertEqual(province.pixelCount, len(rows))
+
+            if not len(rows):
+                continue
+
+            self.assertEqual(province.bbox, (rows.min(), cols.min(),
+                rows.max() + 1, cols.max() + 1))
+            self.assertAlmostEqual(province.centroid[0], rows.mean())
+            self.assertAlmostEqual(province.centroid[1], cols.mean())
+
+            slices, mask = province.window()
+            self.assertEqual(mask.sum(), len(rows))
+            self.assertTrue(mask[rows - slices[0].start,
+                cols - slices[1].start].all())
+
+    def testAdjacency(self):
+        pairs, edgeRows, edgeCols, edgePairs = self.labelMap.adjacency
+
+        self.assertEqual(pairs.tolist(), [[0, 1], [0, 2], [1, 2]])
+
+        # each edge pixel is to the right of, or below, a different label
+        for row,col,pair in zip(edgeRows, edgeCols, edgePairs):
+            label = self.LABELS[row, col]
+            neighbours = []
+
+            if col > 0:
+                neighbours.append(self.LABELS[row, col - 1])
+            if row > 0:
+                neighbours.append(self.LABELS[row - 1, col])
+
+            self.assertTrue(label in pairs[pair])
+            self.assertTrue(any(n != label and n in pairs[pair]
+                for n in neighbours))
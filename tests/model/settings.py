@@ -0,0 +1,63 @@
+import unittest
+
+from tests.settings import import_fresh_settings
+
+
+def suite():
+    loader = unittest.TestLoader()
+
+    return unittest.TestSuite([
+        loader.loadTestsFromTestCase(SettingsTests),
+        ])
+
+
+class SettingsTests(unittest.TestCase):
+    def checkInvalid(self, **values):
+        # every import defines its own InvalidSettings (which isn't kept in
+        # the module), so it can only be recognised by name
+        try:
+            import_fresh_settings(values)
+        except Exception as e:
+            self.assertEqual(type(e).__name__, 'InvalidSettings')
+        else:
+            self.fail('Accepted %s'%values)
+
+    def testDefaults(self):
+        settings = import_fresh_settings({})
+
+        self.assertEqual(settings.keyframe_interval, 365)
+        self.assertEqual(settings.keyframe_memory, 64)
+        self.assertEqual(settings.stripe_width, 5)
+        self.assertEqual(settings.stripe_orientation, 'diagonal')
+
+    def testKeyframes(self):
+        settings = import_fresh_settings({'keyframe_interval': 30,
+            'keyframe_memory': 0.5})
+
+        self.assertEqual(settings.keyframe_interval, 30)
+        self.assertEqual(settings.keyframe_memory, 0.5)
+
+        # no memory at all just keeps the start date
+        import_fresh_settings({'keyframe_memory': 0})
+
+    def testInvalidKeyframes(self):
+        for interval in (0, -1, 1.5, '365', True, None):
+            self.checkInvalid(keyframe_interval=interval)
+
+        for memory in (-1, '64', None):
+            self.checkInvalid(keyframe_memory=memory)
+
+    def testStripes(self):
+        for orientation in ('diagonal', 'antidiagonal', 'horizontal',
+                'vertical'):
+            settings = import_fresh_settings({'stripe_width': 2,
+                'stripe_orientation': orientation})
+
+            self.assertEqual(settings.stripe_orientation, orientation)
+
+    def testInvalidStripes(self):
+        for width in (0, -3, 2.5, '5', None):
+            self.checkInvalid(stripe_width=width)
+
+        for orientation in ('diagonally', '', None):
+            self.checkInvalid(stripe_orientation=orientation)
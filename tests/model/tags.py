@@ -0,0 +1,44 @@
+import unittest
+
+from model.tags import TagTable
+
+
+def suite():
+    loader = unittest.TestLoader()
+
+    return unittest.TestSuite([
+        loader.loadTestsFromTestCase(TagTableTests),
+        ])
+
+
+class TagTableTests(unittest.TestCase):
+    def testNobody(self):
+        tags = TagTable()
+
+        for tag in (None, '', '---'):
+            self.assertEqual(tags.index(tag), 0)
+            self.assertEqual(tags.lookup(tag), 0)
+
+        self.assertEqual(tags.tags, [None])
+        self.assertEqual(TagTable(nobody='').tags, [''])
+
+    def testIndices(self):
+        tags = TagTable(['SWE', 'DAN'])
+
+        self.assertEqual(tags.index('SWE'), 1)
+        self.assertEqual(tags.index('NOR'), 3)
+        self.assertEqual(tags.lookup('DAN'), 2)
+        self.assertEqual(tags.tags, [None, 'SWE', 'DAN', 'NOR'])
+
+        # lookup never adds a tag
+        self.assertRaises(KeyError, tags.lookup, 'FIN')
+        self.assertEqual(len(tags), 4)
+
+    def testCopy(self):
+        tags = TagTable(['SWE'])
+        other = tags.copy()
+        other.index('DAN')
+
+        self.assertEqual(tags.tags, [None, 'SWE'])
+        self.assertEqual(other.tags, [None, 'SWE', 'DAN'])
+        self.assertNotIn('DAN', tags.idxs)
@@ -0,0 +1,76 @@
+from datetime import datetime
+import numpy as np
+import os
+from tempfile import mkdtemp
+import shutil
+import unittest
+
+from tests.model.timelines import make_timeline, START, TAGS, ROWS
+
+from model.ownership import OwnershipIndex
+from model.territory import TerritorySeries, RESOLUTION_YEAR, sample_dates
+
+
+def suite():
+    loader = unittest.TestLoader()
+
+    return unittest.TestSuite([
+        loader.loadTestsFromTestCase(TerritorySeriesTests),
+        ])
+
+
+class TerritorySeriesTests(unittest.TestCase):
+    # see tests.model.timelines for the history
+
+    PIXEL_COUNTS = np.array([10, 20, 40], np.int32)
+
+    def setUp(self):
+        self.dir = mkdtemp()
+
+        # the first sample is before anything is known
+        self.dates = [datetime(1440, 1, 1)] + \
+                sample_dates(START, datetime(1470, 1, 1), RESOLUTION_YEAR)
+
+        self.series = TerritorySeries.fromOwnership(
+                OwnershipIndex(make_timeline(TAGS, ROWS)), self.dates,
+                self.PIXEL_COUNTS)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def testChangesOnly(self):
+        # occupation, and rows which don't change the owner, aren't stored
+        self.assertEqual(self.series.tags, ['SWE', 'DAN', 'NOR', 'SCA'])
+        self.assertEqual(self.series.changeIdxs.tolist(), [1, 9, 17])
+        self.assertEqual(self.series.provinceCounts.tolist(),
+                [[1, 0, 1, 0], [0, 1, 0, 1], [1, 0, 0, 1]])
+
+    def testValuesAt(self):
+        self.assertEqual(self.series.valuesAt([0, 1, 8, 9, 16, 17]).tolist(), [
+                [0, 0, 0, 0],
+                [1, 0, 1, 0],
+                [1, 0, 1, 0],
+                [0, 1, 0, 1],
+                [0, 1, 0, 1],
+                [1, 0, 0, 1],
+            ])
+
+        last = len(self.dates) - 1
+        self.assertEqual(self.series.valuesAt([last], areas=True).tolist(),
+                [[10, 0, 0, 20]])
+
+    def testWriteCSV(self):
+        fn = os.path.join(self.dir, 'territory.csv')
+        self.series.writeCSV(fn, areas=True)
+
+        with open(fn) as f:
+            lines = f.read().splitlines()
+
+        self.assertEqual(len(lines), len(self.dates) + 1)
+        self.assertEqual(lines[:3], [
+                'date,SWE,DAN,NOR,SCA',
+                '1440.1.1,0,0,0,0',
+                '1444.11.11,10,0,20,0',
+            ])
+        self.assertEqual(lines[10], '1452.11.11,0,10,0,20')
+        self.assertEqual(lines[-1], '1469.11.11,10,0,0,20')
@@ -0,0 +1,165 @@
+from datetime import datetime
+import os
+from tempfile import mkdtemp
+import shutil
+import unittest
+
+from tests.settings import load_test_settings
+load_test_settings()
+
+from model.timeline import Timeline, KIND_START, KIND_PROVINCE, \
+        KIND_TAG_CHANGE, date_to_ordinal, get_timeline_path, \
+        load_timeline_for_save, write_timeline_for_save
+from parsers.history import index_dates_with_events, CONTROLLER, OWNER, \
+        EVENT_TYPE, EVENT_TAG_CHANGE, SOURCE_TAG
+
+
+def suite():
+    loader = unittest.TestLoader()
+
+    return unittest.TestSuite([
+        loader.loadTestsFromTestCase(FromHistoriesTests),
+        loader.loadTestsFromTestCase(TimelineForSaveTests),
+        ])
+
+
+START = datetime(1444, 11, 11)
+
+START_STATES = {1: ('SWE', 'SWE'), 5: ('SCA', 'SCA'), 9: ('SCA', 'DAN'),
+        12: (None, None)}
+
+
+def tag_change(source):
+    return {EVENT_TYPE: EVENT_TAG_CHANGE, SOURCE_TAG: source}
+
+
+class FromHistoriesTests(unittest.TestCase):
+    def setUp(self):
+        provinceHistories = {
+                1: {
+                    START: {OWNER: 'SWE', CONTROLLER: 'SWE'},
+
+                    # changes nothing
+                    datetime(1450, 1, 1): {OWNER: 'SWE'},
+
+                    datetime(1452, 6, 1): {CONTROLLER: 'DAN'},
+                },
+                12: {
+                    datetime(1460, 1, 1): {OWNER: 'SCA', CONTROLLER: 'SCA'},
+                },
+            }
+
+        countryHistories = {
+                # SCA owns 5 and 9 (and by then 12), and controls 5 and 12
+                'NOR': {datetime(1470, 1, 1): tag_change('SCA')},
+
+                # nobody ever held anything as FIN
+                'KAR': {datetime(1470, 1, 1): tag_change('FIN')},
+            }
+
+        datesWithEvents = index_dates_with_events(provinceHistories,
+                countryHistories)
+
+        self.timeline = Timeline.fromHistories(provinceHistories,
+                countryHistories, datesWithEvents, START_STATES, START)
+
+    def _rows(self, kind):
+        # (date, pID, owner, controller) for each row of the kind
+        timeline = self.timeline
+        fTag = lambda i: timeline.tags[i] if i else None
+
+        return [(timeline.dates[i], int(timeline.provinceIds[
+                    timeline.provinceIdxs[i]]),
+                fTag(timeline.owners[i]), fTag(timeline.controllers[i]))
+            for i in xrange(len(timeline)) if timeline.kinds[i] == kind]
+
+    def testStartRows(self):
+        start = date_to_ordinal(START)
+
+        self.assertEqual(self._rows(KIND_START), [
+                (start, 1, 'SWE', 'SWE'),
+                (start, 5, 'SCA', 'SCA'),
+                (start, 9, 'SCA', 'DAN'),
+                (start, 12, None, None),
+            ])
+
+    def testEventsWhichChangeNothing(self):
+        # the 1450 event for province 1 doesn't get a row
+        self.assertEqual(self._rows(KIND_PROVINCE), [
+                (date_to_ordinal(datetime(1452, 6, 1)), 1, 'SWE', 'DAN'),
+                (date_to_ordinal(datetime(1460, 1, 1)), 12, 'SCA', 'SCA'),
+            ])
+
+    def testTagChanges(self):
+        # a row for every province which the old tag owned or controlled,
+        # and none for a tag which never held anything
+        date = date_to_ordinal(datetime(1470, 1, 1))
+
+        self.assertEqual(self._rows(KIND_TAG_CHANGE), [
+                (date, 5, 'NOR', 'NOR'),
+                (date, 9, 'NOR', 'DAN'),
+                (date, 12, 'NOR', 'NOR'),
+            ])
+        self.assertNotIn('KAR', self.timeline.tags)
+
+
+class TimelineForSaveTests(unittest.TestCase):
+    def setUp(self):
+        self.dir = mkdtemp()
+        self.savePath = os.path.join(self.dir, 'save.eu4')
+        self._writeSave('EU4txt\n')
+
+        self.timeline = Timeline.fromHistories({}, {}, {}, START_STATES, START)
+        write_timeline_for_save(self.savePath, self.timeline, START,
+                START_STATES)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _writeSave(self, contents):
+        with open(self.savePath, 'w') as f:
+            f.write(contents)
+
+    def _load(self, startStates=START_STATES, startDate=START):
+        return load_timeline_for_save(self.savePath, startStates, startDate)
+
+    def testLoads(self):
+        timeline = self._load()
+
+        self.assertIsNotNone(timeline)
+        self.assertEqual(timeline.tags, self.timeline.tags)
+        self.assertEqual(timeline.owners.tolist(),
+                self.timeline.owners.tolist())
+
+    def testMissingOrInvalid(self):
+        os.remove(get_timeline_path(self.savePath))
+        self.assertIsNone(self._load())
+
+        with open(get_timeline_path(self.savePath), 'w') as f:
+            f.write('not a timeline')
+
+        self.assertIsNone(self._load())
+
+    def testSaveChanged(self):
+        # a different size
+        self._writeSave('EU4txt\ndate=1450.1.1\n')
+        self.assertIsNone(self._load())
+
+    def testSaveTouched(self):
+        st = os.stat(self.savePath)
+        os.utime(self.savePath, (st.st_atime, st.st_mtime + 10))
+
+        self.assertIsNone(self._load())
+
+    def testStartDateChanged(self):
+        self.assertIsNone(self._load(startDate=datetime(1445, 1, 1)))
+
+    def testStartStatesChanged(self):
+        startStates = dict(START_STATES)
+        startStates[12] = ('SWE', 'SWE')
+        self.assertIsNone(self._load(startStates=startStates))
+
+        # or a province has been added
+        startStates = dict(START_STATES)
+        startStates[13] = (None, None)
+        self.assertIsNone(self._load(startStates=startStates))
@@ -0,0 +1,49 @@
+from datetime import datetime
+import numpy as np
+
+from tests.settings import load_test_settings
+load_test_settings()
+
+from model.timeline import Timeline, KIND_START, KIND_PROVINCE, \
+        KIND_TAG_CHANGE, date_to_ordinal
+
+
+START = datetime(1444, 11, 11)
+
+
+def make_timeline(tags, rows, provinceIds=(1, 5, 9)):
+    # rows are (date, province index, owner, controller, kind), in timeline
+    # order, with owners and controllers as indices into tags
+    columns = zip(*rows)
+
+    return Timeline(
+            np.array(provinceIds, np.int32),
+            tags,
+            np.array(map(date_to_ordinal, columns[0]), np.int32),
+            np.array(columns[1], np.int32),
+            np.array(columns[2], np.int16),
+            np.array(columns[3], np.int16),
+            np.array(columns[4], np.int8),
+        )
+
+
+# provinces 1, 5 and 9 (indices 0, 1 and 2), and tags:
+#  * 1 (SWE) and 2 (DAN) at war over province 1;
+#  * 3 (NOR) owning province 5, until it becomes 4 (SCA); and
+#  * province 9, which is uncolonised and never has any events
+TAGS = ['', 'SWE', 'DAN', 'NOR', 'SCA']
+
+ROWS = [
+        (START, 0, 1, 1, KIND_START),
+        (START, 1, 3, 3, KIND_START),
+        (START, 2, 0, 0, KIND_START),
+
+        # occupied, then ceded, on the same day as NOR becomes SCA
+        (datetime(1450, 1, 1), 0, 1, 2, KIND_PROVINCE),
+        (datetime(1452, 6, 1), 0, 2, 2, KIND_PROVINCE),
+        (datetime(1452, 6, 1), 1, 4, 4, KIND_TAG_CHANGE),
+
+        # two rows for the same province on the same day: the last wins
+        (datetime(1460, 3, 1), 0, 2, 1, KIND_PROVINCE),
+        (datetime(1460, 3, 1), 0, 1, 1, KIND_PROVINCE),
+    ]
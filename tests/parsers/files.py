@@ -4,6 +4,7 @@ import unittest
 
 from parsers.files import parse_object
 from parsers.files import read_token
+from parsers.files import OBJECT, TokenStream, iter_pairs, iter_values
 
 
 def suite():
@@ -13,6 +14,7 @@ def suite():
         loader.loadTestsFromTestCase(ParseObjectReadingTests),
         loader.loadTestsFromTestCase(ParseObjectParsingTests),
         loader.loadTestsFromTestCase(ReadTokenTests),
+        loader.loadTestsFromTestCase(TokenStreamTests),
         ])
 
 
@@ -598,3 +600,128 @@ class ReadTokenTests(unittest.TestCase):
                 ]
 
         stream = self.checkMultiple(s, endTokenMarkers, expected)
+
+
+class TokenStreamTests(unittest.TestCase):
+    def _walk(self, tokens):
+        # rebuild a nested structure from the stream, so that it can be
+        # compared against what we expect
+        out = []
+
+        for key,value in iter_pairs(tokens):
+            if value is OBJECT:
+                value = self._walk(tokens)
+
+            out.append((key, value))
+
+        return out
+
+    def check(self, s, expected, header=False):
+        tokens = TokenStream(StringIO(s), header=header)
+
+        self.assertEqual(self._walk(tokens), expected)
+
+    def testSingleKeyValuePair(self):
+        s = 'key=value'
+        expected = [('key', 'value')]
+
+        self.check(s, expected)
+
+    def testHeaderIsSkipped(self):
+        s = '''EU4txt
+                key=value
+            '''
+        expected = [('key', 'value')]
+
+        self.check(s, expected, header=True)
+
+    def testQuotedValuesAreKept(self):
+        s = 'key="Multiple Word String"'
+        expected = [('key', '"Multiple Word String"')]
+
+        self.check(s, expected)
+
+    def testNestedObjects(self):
+        s = '''
+                key={
+                    key=
+                    {
+                        key=value
+                    }
+                }
+                key2=value2
+            '''
+        expected = [
+                ('key', [('key', [('key', 'value')])]),
+                ('key2', 'value2'),
+                ]
+
+        self.check(s, expected)
+
+    def testCommentsAreIgnored(self):
+        s = '''
+                key=value # comment = { 
+                # key2=value2
+                key3=value3
+            '''
+        expected = [('key', 'value'), ('key3', 'value3')]
+
+        self.check(s, expected)
+
+    def testExtraneousObjectsAreIgnored(self):
+        s = '''
+                key=value
+                {
+                }
+                key2=value2
+            '''
+        expected = [('key', 'value'), ('key2', 'value2')]
+
+        self.check(s, expected)
+
+    def testUnconsumedObjectsAreSkipped(self):
+        s = '''
+                key={
+                    key={ a b c }
+                    key={
+                        key=value
+                    }
+                }
+                key2=value2
+            '''
+        tokens = TokenStream(StringIO(s))
+        result = [(k, v) for k,v in iter_pairs(tokens) if v is not OBJECT]
+
+        self.assertEqual(result, [('key2', 'value2')])
+
+    def testSkippingStopsAtBraceOnSameLine(self):
+        s = '''
+                key={
+                    key={ a }
+                } key2=value2
+            '''
+        tokens = TokenStream(StringIO(s))
+        result = [(k, v) for k,v in iter_pairs(tokens) if v is not OBJECT]
+
+        self.assertEqual(result, [('key2', 'value2')])
+
+    def testArrayValues(self):
+        s = '''
+                key={ one two "three four" }
+                key2=value2
+            '''
+        tokens = TokenStream(StringIO(s))
+        result = []
+
+        for key,value in iter_pairs(tokens):
+            if value is OBJECT:
+                result.append((key, list(iter_values(tokens))))
+            else:
+                result.append((key, value))
+
+        expected = [
+                ('key', ['one', 'two', '"three four"']),
+                ('key2', 'value2'),
+                ]
+
+        self.assertEqual(result, expected)
@@ -0,0 +1,148 @@
+from datetime import datetime
+from StringIO import StringIO
+import unittest
+
+from tests.settings import load_test_settings
+load_test_settings()
+
+from model.countries import Country
+from parsers.countries import create_dynamic_countries
+from parsers.files import parse_file
+from parsers.history import build_history, build_history_from_file, \
+        CONTROLLER, OWNER
+
+
+def suite():
+    loader = unittest.TestLoader()
+
+    return unittest.TestSuite([
+        loader.loadTestsFromTestCase(BuildHistoryFromFileTests),
+        ])
+
+
+# repeated dates, nested controllers, a tag change, subjects (of a dynamic
+# country), a blank key, and some junk where a country should be
+#
+# NB: parse_file needs keys and values on lines of their own to get these
+# right, as real saves have them
+SAVE = '''EU4txt
+date=1480.1.1
+dynamic_countries={
+"D00"
+"D01"
+}
+provinces={
+-1={
+	name="Stockholm"
+	history={
+		owner="SWE"
+		1450.1.1={
+			owner="FIN"
+		}
+		1460.1.1={
+			controller={
+				controller="SWE"
+			}
+		}
+		1460.1.1={
+			owner="NOR"
+		}
+		{
+		}
+	}
+}
+-2={
+	name="X"
+	history={
+		1455.3.3={
+			owner="SWE"
+			controller={
+				controller="SWE"
+			}
+		}
+	}
+}
+}
+countries={
+	SWE={
+		subjects={
+			"D00"
+		}
+		history={
+			1470.1.1={
+				changed_tag_from="SCA"
+			}
+		}
+	}
+	NOR={
+		history={
+			1400.1.1={ x=1 }
+		}
+	}
+	junk=5
+}
+'''
+
+START_STATES = {1: ('SWE', 'SWE'), 2: (None, None), 3: ('NOR', 'NOR')}
+
+
+class BuildHistoryFromFileTests(unittest.TestCase):
+    def _countries(self):
+        countries = {tag: Country(tag) for tag in ('SWE', 'NOR', 'FIN')}
+
+        for i,country in enumerate(countries.itervalues()):
+            country.col = (i, i, i)
+
+        return countries
+
+    def testMatchesParseFile(self):
+        expectedCountries = self._countries()
+        save = parse_file(StringIO(SAVE), header=True)
+        expected = build_history(save, START_STATES)
+        create_dynamic_countries(save, expectedCountries)
+
+        countries = self._countries()
+        histories = build_history_from_file(StringIO(SAVE), START_STATES,
+                countries)
+
+        provinceHistories, countryHistories, datesWithEvents = histories
+
+        self.assertEqual(provinceHistories, expected[0])
+        self.assertEqual(countryHistories, expected[1])
+
+        # the order provinces and countries are listed in for a date doesn't
+        # matter
+        fSorted = lambda d: {date: {k: sorted(ids) for k,ids in v.iteritems()}
+                for date,v in d.iteritems()}
+        self.assertEqual(fSorted(datesWithEvents), fSorted(expected[2]))
+
+        self.assertEqual(sorted(countries), sorted(expectedCountries))
+
+        for tag,country in countries.iteritems():
+            self.assertEqual(country.col, expectedCountries[tag].col)
+
+    def testProvinceHistories(self):
+        provinceHistories,_,_ = build_history_from_file(StringIO(SAVE),
+                START_STATES, self._countries())
+
+        # only provinces in the save get a history; the earlier of two
+        # blocks for the same date wins where they disagree
+        self.assertEqual(provinceHistories, {
+                1: {
+                    datetime(1444, 11, 11): {OWNER: 'SWE', CONTROLLER: 'SWE'},
+                    datetime(1450, 1, 1): {OWNER: 'FIN'},
+                    datetime(1460, 1, 1): {OWNER: 'NOR', CONTROLLER: 'SWE'},
+                },
+                2: {
+                    datetime(1444, 11, 11): {OWNER: None, CONTROLLER: None},
+                    datetime(1455, 3, 3): {OWNER: 'SWE', CONTROLLER: 'SWE'},
+                },
+            })
+
+    def testDynamicCountries(self):
+        countries = self._countries()
+        build_history_from_file(StringIO(SAVE), START_STATES, countries)
+
+        # subjects take their master's colour
+        self.assertEqual(countries['D00'].col, countries['SWE'].col)
+        self.assertEqual(countries['D01'].col, [0, 0, 0])
@@ -0,0 +1,65 @@
+from datetime import datetime
+import os
+import unittest
+
+from tests.settings import load_test_settings, use_eu4_directory
+load_test_settings()
+
+from model.provinces import Province
+from parsers.provinces import get_province_start_states, \
+        parse_province_histories
+
+
+def suite():
+    loader = unittest.TestLoader()
+
+    return unittest.TestSuite([
+        loader.loadTestsFromTestCase(ProvinceHistoriesTests),
+        ])
+
+
+HISTORY_FILES = {
+        # the last owner in the file is in a block that's yet to happen
+        os.path.join('history', 'provinces', '1 - Stockholm.txt'): '''
+owner = SWE
+controller = SWE # until 1400
+1400.1.1 = { owner = DAN controller = DAN }
+1450.1.1 = {
+	owner = NOR
+	controller = NOR
+}
+''',
+        # only the controller changes
+        os.path.join('history', 'provinces', '2 - Uppland.txt'): '''
+owner = SWE
+controller = SWE
+1450.1.1 = {
+	controller = DAN
+}
+''',
+    }
+
+
+class ProvinceHistoriesTests(unittest.TestCase):
+    def setUp(self):
+        use_eu4_directory(self, HISTORY_FILES)
+
+    def testDatedBlocks(self):
+        histories = parse_province_histories()
+
+        self.assertEqual(histories.stateAt(datetime(1399, 1, 1)),
+                {1: ('SWE', 'SWE'), 2: ('SWE', 'SWE')})
+        self.assertEqual(histories.stateAt(datetime(1444, 11, 11)),
+                {1: ('DAN', 'DAN'), 2: ('SWE', 'SWE')})
+        self.assertEqual(histories.stateAt(datetime(1460, 1, 1)),
+                {1: ('NOR', 'NOR'), 2: ('SWE', 'DAN')})
+
+    def testStartStates(self):
+        # provinces without a history file have nobody
+        provinces = {pID: Province(pID) for pID in (1, 2, 3)}
+
+        self.assertEqual(get_province_start_states(provinces),
+                {1: ('DAN', 'DAN'), 2: ('SWE', 'SWE'), 3: (None, None)})
+        self.assertEqual(get_province_start_states(provinces,
+                    datetime(1460, 1, 1)),
+                {1: ('NOR', 'NOR'), 2: ('SWE', 'DAN'), 3: (None, None)})
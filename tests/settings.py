@@ -0,0 +1,97 @@
+from __future__ import absolute_import
+
+import json
+import os
+from tempfile import mkdtemp
+import shutil
+import sys
+
+# model.settings is read from settings.cfg in the working directory when it's
+# first imported, and insists that the eu4 directory exists, so tests of
+# modules which import it load it from a throwaway directory instead
+
+SETTINGS = {
+        'start_date': '1444.11.11',
+        'end_date': '1821.1.1',
+        'month_names': ['January', 'February', 'March', 'April', 'May',
+            'June', 'July', 'August', 'September', 'October', 'November',
+            'December'],
+        'gif_settings': {},
+        'mods': {
+            'mods_directory': '',
+            'mod_name': '',
+        },
+    }
+
+
+def _import_settings(values):
+    root = mkdtemp()
+    cwd = os.getcwd()
+
+    try:
+        with open(os.path.join(root, 'settings.cfg'), 'w') as f:
+            f.write(json.dumps(dict(SETTINGS, eu4_directory=root, **values)))
+
+        # the repository may only be on the path relative to where we were
+        sys.path.insert(0, cwd)
+        os.chdir(root)
+
+        import model.settings
+        return model.settings
+    finally:
+        os.chdir(cwd)
+        sys.path.remove(cwd)
+        shutil.rmtree(root)
+
+
+def load_test_settings():
+    if 'model.settings' in sys.modules:
+        return
+
+    _import_settings({})
+
+
+def import_fresh_settings(values):
+    # imports model.settings again, from the test settings updated with
+    # values, and returns it (or raises whatever it does); the settings the
+    # tests are using are left as they were
+    load_test_settings()
+
+    import model
+    settings = sys.modules.pop('model.settings')
+
+    try:
+        return _import_settings(values)
+    finally:
+        sys.modules['model.settings'] = model.settings = settings
+
+
+def use_eu4_directory(testCase, files):
+    # points the settings at a throwaway eu4 directory holding files (a
+    # {relative path: contents} dict) for the rest of the test
+    import model.settings as settings
+    import parsers.provinces
+
+    root = mkdtemp()
+
+    for path,contents in files.iteritems():
+        fn = os.path.join(root, path)
+
+        if not os.path.isdir(os.path.dirname(fn)):
+            os.makedirs(os.path.dirname(fn))
+
+        with open(fn, 'w') as f:
+            f.write(contents)
+
+    def fRestore(eu4Directory=settings.eu4_directory):
+        settings.eu4_directory = eu4Directory
+        parsers.provinces._provinceHistories = None
+        shutil.rmtree(root)
+
+    testCase.addCleanup(fRestore)
+
+    # the province histories are cached for whichever directory was first
+    settings.eu4_directory = root
+    parsers.provinces._provinceHistories = None
+
+    return root
@@ -0,0 +1,71 @@
+import numpy as np
+import os
+from tempfile import mkdtemp
+import shutil
+import unittest
+
+from tools.binfile import read_arrays, write_arrays, InvalidFile
+
+
+def suite():
+    loader = unittest.TestLoader()
+
+    return unittest.TestSuite([
+        loader.loadTestsFromTestCase(BinaryFileTests),
+        ])
+
+
+class BinaryFileTests(unittest.TestCase):
+    MAGIC = 'TESTFILE'
+
+    def setUp(self):
+        self.dir = mkdtemp()
+        self.fn = os.path.join(self.dir, 'test.bin')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def testArraysRoundTrip(self):
+        arrays = [
+                ('a', np.arange(10, dtype=np.int32)),
+                ('b', np.arange(12, dtype=np.int16).reshape(3, 4)),
+                ('c', np.array([1.5, 2.5])),
+                ]
+
+        write_arrays(self.fn, self.MAGIC, 1, {}, arrays)
+        _,result = read_arrays(self.fn, self.MAGIC, 1)
+
+        for name,arr in arrays:
+            self.assertEqual(result[name].dtype, arr.dtype)
+            self.assertTrue(np.array_equal(result[name], arr))
+
+    def testMetaRoundTrips(self):
+        meta = {'names': ['one', 'two'], 'count': 2}
+
+        write_arrays(self.fn, self.MAGIC, 1, meta, [])
+        result,_ = read_arrays(self.fn, self.MAGIC, 1)
+
+        self.assertEqual(result, meta)
+
+    def testEmptyArraysRoundTrip(self):
+        write_arrays(self.fn, self.MAGIC, 1, {},
+                [('empty', np.zeros(0, np.int32))])
+        _,result = read_arrays(self.fn, self.MAGIC, 1)
+
+        self.assertEqual(result['empty'].shape, (0,))
+
+    def testArraysAreMemoryMapped(self):
+        write_arrays(self.fn, self.MAGIC, 1, {}, [('a', np.arange(10))])
+        _,result = read_arrays(self.fn, self.MAGIC, 1)
+
+        self.assertIsInstance(result['a'], np.memmap)
+
+    def testWrongMagicIsInvalid(self):
+        write_arrays(self.fn, self.MAGIC, 1, {}, [])
+
+        self.assertRaises(InvalidFile, read_arrays, self.fn, 'OTHERFIL', 1)
+
+    def testWrongVersionIsInvalid(self):
+        write_arrays(self.fn, self.MAGIC, 1, {}, [])
+
+        self.assertRaises(InvalidFile, read_arrays, self.fn, self.MAGIC, 2)
@@ -0,0 +1,70 @@
+from cStringIO import StringIO
+import numpy as np
+import os
+import struct
+from tempfile import mkdtemp
+import shutil
+import unittest
+
+from tools.bmp import read_bmp, InvalidBitmap
+
+
+def suite():
+    loader = unittest.TestLoader()
+
+    return unittest.TestSuite([
+        loader.loadTestsFromTestCase(BitmapTests),
+        ])
+
+
+def make_bmp(img, topDown=False, bpp=24):
+    # a minimal uncompressed bitmap of the RGB image
+    h,w,_ = img.shape
+    stride = (w*3 + 3)//4*4
+
+    rows = img if topDown else img[::-1]
+    data = np.zeros((h, stride), np.uint8)
+    data[:,:w*3] = rows[:,:,::-1].reshape(h, w*3)
+
+    header = struct.pack('<2sIHHI', 'BM', 54 + data.nbytes, 0, 0, 54)
+    info = struct.pack('<IiiHHIIiiII', 40, w, -h if topDown else h, 1, bpp,
+            0, data.nbytes, 0, 0, 0, 0)
+
+    return header + info + data.tostring()
+
+
+class BitmapTests(unittest.TestCase):
+    def setUp(self):
+        self.dir = mkdtemp()
+        self.fn = os.path.join(self.dir, 'test.bmp')
+
+        # an odd width, so that rows are padded
+        self.img = np.random.RandomState(0).randint(0, 256,
+                (7, 5, 3)).astype(np.uint8)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _readFile(self, data):
+        with open(self.fn, 'wb') as f:
+            f.write(data)
+
+        with open(self.fn, 'rb') as f:
+            return read_bmp(f)
+
+    def testBottomUp(self):
+        img = self._readFile(make_bmp(self.img))
+        self.assertTrue(np.array_equal(img, self.img))
+
+    def testTopDown(self):
+        img = self._readFile(make_bmp(self.img, topDown=True))
+        self.assertTrue(np.array_equal(img, self.img))
+
+    def testStream(self):
+        img = read_bmp(StringIO(make_bmp(self.img)))
+        self.assertTrue(np.array_equal(img, self.img))
+
+    def testUnsupported(self):
+        self.assertRaises(InvalidBitmap, read_bmp,
+                StringIO(make_bmp(self.img, bpp=32)))
+        self.assertRaises(InvalidBitmap, read_bmp, StringIO('GIF89a' + '0'*64))
@@ -0,0 +1,118 @@
+import json
+import numpy as np
+import os
+import struct
+
+## Binary Array File Format
+#
+# < magic (8 bytes) >< version (uint32) >< header length (uint32) >
+# < header: json, giving metadata and the dtype, shape and offset of each
+#   array >
+# < array data, each array starting on an ALIGNMENT byte boundary >
+#
+# All integers are little-endian.  Array offsets are relative to the start of
+# the array data, which is itself aligned.
+#
+# Arrays are read back with np.memmap, so opening a file involves no parsing
+# beyond the header, and several processes reading the same file will share
+# the same pages.
+
+ALIGNMENT = 64
+
+_PREFIX = struct.Struct('<8sII')
+
+
+class InvalidFile(Exception):
+    pass
+
+
+def _align(n):
+    return (n + ALIGNMENT - 1)//ALIGNMENT*ALIGNMENT
+
+
+def write_arrays(fn, magic, version, meta, arrays):
+    # arrays is a sequence of (name, array) pairs
+    descriptors = []
+    offset = 0
+
+    for name,arr in arrays:
+        arr = np.ascontiguousarray(arr)
+
+        descriptors.append({
+                'name': name,
+                'dtype': arr.dtype.str,
+                'shape': list(arr.shape),
+                'offset': offset,
+            })
+
+        offset = _align(offset + arr.nbytes)
+
+    header = json.dumps({'meta': meta, 'arrays': descriptors})
+    dataStart = _align(_PREFIX.size + len(header))
+
+    # write to a temporary file first, so that readers never see half a file
+    tmpFn = fn + '.tmp'
+
+    with open(tmpFn, 'wb') as f:
+        f.write(_PREFIX.pack(magic, version, len(header)))
+        f.write(header)
+
+        for (name,arr),descriptor in zip(arrays, descriptors):
+            f.seek(dataStart + descriptor['offset'])
+            f.write(np.ascontiguousarray(arr).tostring())
+
+    # windows won't rename over an existing file
+    if os.path.exists(fn):
+        os.remove(fn)
+
+    os.rename(tmpFn, fn)
+
+
+def read_header(fn, magic):
+    with open(fn, 'rb') as f:
+        prefix = f.read(_PREFIX.size)
+
+        if len(prefix) != _PREFIX.size:
+            raise InvalidFile('Truncated file: %s'%fn)
+
+        fileMagic, version, headerLength = _PREFIX.unpack(prefix)
+
+        if fileMagic != magic:
+            raise InvalidFile('Not a %s file: %s'%(magic.strip(), fn))
+
+        header = json.loads(f.read(headerLength))
+
+    header['version'] = version
+    header['dataStart'] = _align(_PREFIX.size + headerLength)
+
+    return header
+
+
+def is_binary_file(fn, magic):
+    with open(fn, 'rb') as f:
+        return f.read(len(magic)) == magic
+
+
+def read_arrays(fn, magic, version):
+    header = read_header(fn, magic)
+
+    if header['version'] != version:
+        raise InvalidFile('Unsupported version %d (expected %d): %s'%(
+            header['version'], version, fn))
+
+    arrays = {}
+
+    for descriptor in header['arrays']:
+        dtype = np.dtype(str(descriptor['dtype']))
+        shape = tuple(descriptor['shape'])
+
+        # numpy refuses to map zero bytes
+        if not np.prod(shape):
+            arrays[descriptor['name']] = np.zeros(shape, dtype)
+            continue
+
+        arrays[descriptor['name']] = np.memmap(fn, dtype=dtype, mode='r',
+                offset=header['dataStart'] + descriptor['offset'],
+                shape=shape)
+
+    return header['meta'], arrays
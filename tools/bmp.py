@@ -0,0 +1,75 @@
+import numpy as np
+import struct
+
+## Bitmap Reading
+#
+# provinces.bmp is an uncompressed 24-bit bitmap, so its pixels can be used
+# straight from the file: we map the pixel data, and return a view which
+# undoes the bitmap's quirks without copying anything:
+#  * rows are stored bottom-up (unless the height is negative);
+#  * each row is padded to a multiple of 4 bytes; and
+#  * pixels are stored as BGR.
+#
+# Files which can't be mapped (eg, inside a zip) are read into memory
+# instead, and viewed the same way.
+
+_FILE_HEADER = struct.Struct('<2sIHHI')
+_INFO_HEADER = struct.Struct('<IiiHHI')
+
+BI_RGB = 0
+
+
+class InvalidBitmap(Exception):
+    pass
+
+
+def read_bmp_header(f):
+    # (data offset, width, height, top down) for a 24-bit, uncompressed bitmap
+    data = f.read(_FILE_HEADER.size + _INFO_HEADER.size)
+
+    if len(data) != _FILE_HEADER.size + _INFO_HEADER.size:
+        raise InvalidBitmap('Truncated bitmap')
+
+    magic, _, _, _, dataOffset = _FILE_HEADER.unpack_from(data)
+    _, width, height, _, bpp, compression = _INFO_HEADER.unpack_from(data,
+            _FILE_HEADER.size)
+
+    if magic != 'BM':
+        raise InvalidBitmap('Not a bitmap')
+
+    if bpp != 24 or compression != BI_RGB:
+        raise InvalidBitmap('Unsupported bitmap (%d bpp, compression %d)'%(
+            bpp, compression))
+
+    return dataOffset, width, abs(height), height < 0
+
+
+def _pixel_view(data, width, height, topDown):
+    # data holds the padded rows, as a (height, stride) array
+    img = data[:,:width*3].reshape(height, width, 3)
+
+    if not topDown:
+        img = img[::-1]
+
+    # BGR -> RGB
+    return img[:,:,::-1]
+
+
+def read_bmp(f):
+    # an (height, width, 3) RGB view of the bitmap in the file object f
+    dataOffset, width, height, topDown = read_bmp_header(f)
+    stride = (width*3 + 3)//4*4
+
+    if isinstance(f, file):
+        data = np.memmap(f.name, dtype=np.uint8, mode='r',
+                offset=dataOffset, shape=(height, stride))
+    else:
+        f.read(dataOffset - _FILE_HEADER.size - _INFO_HEADER.size)
+        buf = f.read(height*stride)
+
+        if len(buf) != height*stride:
+            raise InvalidBitmap('Truncated bitmap')
+
+        data = np.frombuffer(buf, np.uint8).reshape(height, stride)
+
+    return _pixel_view(data, width, height, topDown)